@@ -0,0 +1,182 @@
+import math
+import random
+from Tanks import weapon
+from Tanks.engine import Action
+from Tanks.player import TURRET_SPEED, TURRET_STEPS, TANK_WIDTH, turret_endpoint
+
+'''
+Computer controlled tanks.
+
+At the start of its turn a Computer picks a target and a weapon, and asks the
+ShotSolver for the turret angle and power that land a shell closest to the
+target. It then plays that out one tick at a time through engine Actions,
+exactly like a player at the keyboard would, and fires.
+
+The difficulty sets how far off (in pixels, standard deviation) the point the
+computer aims at is from the tank it is aiming for.
+'''
+DIFFICULTIES = {'Easy': 60, 'Medium': 25, 'Hard': 8}
+
+# Spacing of the coarse power grid, the fine search covers the gaps around the
+# best coarse shots
+COARSE_POWER_STEP = 8
+COARSE_CANDIDATES = 4
+# Only the closest enemies are considered, so large battles stay cheap
+MAX_TARGETS = 5
+
+
+'''
+Finds (angle, power) settings that land a shell near a target.
+
+Every angle and power is one a player can actually dial in from the current
+turret settings with the arrow and z/x keys, so solved shots fly exactly as
+fired shots do. Impact points are memoized per tank position and terrain
+state, and all missing ones are computed in a single batch.
+'''
+class ShotSolver:
+    def __init__(self):
+        self.state = None
+        self.impacts = {}
+
+    '''
+    @return the turret angles reachable with the arrow keys, every turret
+    step (as Player.move sets them), in increasing order
+    '''
+    def reachable_angles(self, player):
+        return [step*TURRET_SPEED for step in range(TURRET_STEPS + 1)]
+
+    '''
+    @return the powers reachable from the current one with z/x, in increasing order
+    '''
+    def reachable_powers(self, player):
+        powers = {player.power}
+        power = player.power
+        while power < player.health:
+            power = min(player.health, power + 1)
+            powers.add(power)
+        power = player.power
+        while power > 0:
+            power = max(power - 1, 0)
+            powers.add(power)
+        return sorted(powers)
+
+    '''
+    @return the impact point of each (angle, power) shot fired by player
+    '''
+    def land(self, player, game_map, shots):
+        state = (id(game_map), game_map.version, player.rect.center)
+        if state != self.state:
+            self.state = state
+            self.impacts = {}
+        missing = [shot for shot in dict.fromkeys(shots) if shot not in self.impacts]
+        if missing:
+            starts = [turret_endpoint(player.rect, angle) for angle, _ in missing]
+            ends = weapon.impacts(starts, player.fps, [power for _, power in missing],
+                                  [angle for angle, _ in missing], game_map.get_terrain())
+            for shot, end in zip(missing, ends):
+                self.impacts[shot] = end
+        return [self.impacts[shot] for shot in shots]
+
+    '''
+    Coarse to fine search for the shot landing closest to target
+    @return (miss distance, angle, power, impact point)
+    '''
+    def solve(self, player, game_map, target):
+        angles = self.reachable_angles(player)
+        powers = self.reachable_powers(player)
+        coarse = [(a, p) for a in range(len(angles)) for p in range(0, len(powers), COARSE_POWER_STEP)]
+        best = self.rank(player, game_map, target, angles, powers, coarse)[:COARSE_CANDIDATES]
+        fine = set()
+        for _, a, p, _ in best:
+            for angle in range(max(a - 1, 0), min(a + 2, len(angles))):
+                for power in range(max(p - COARSE_POWER_STEP, 0), min(p + COARSE_POWER_STEP + 1, len(powers))):
+                    fine.add((angle, power))
+        miss, a, p, impact = self.rank(player, game_map, target, angles, powers, sorted(fine))[0]
+        return miss, angles[a], powers[p], impact
+
+    def rank(self, player, game_map, target, angles, powers, indices):
+        impacts = self.land(player, game_map, [(angles[a], powers[p]) for a, p in indices])
+        ranked = [(math.hypot(impact[0] - target[0], impact[1] - target[1]), a, p, impact)
+                  for (a, p), impact in zip(indices, impacts)]
+        ranked.sort(key=lambda shot: shot[0])
+        return ranked
+
+
+'''
+A computer player, with the same act()/shop() interface as the batch runner
+policies.
+@param difficulty is one of DIFFICULTIES
+'''
+class Computer:
+    def __init__(self, difficulty='Medium', rng=None):
+        self.difficulty = difficulty
+        self.rng = rng if rng is not None else random.Random()
+        self.solver = ShotSolver()
+        self.plan = None
+
+    '''
+    @return the Action for this tick, planning the shot on the first tick of a turn
+    '''
+    def act(self, engine):
+        player = engine.current_player()
+        if self.plan is None:
+            self.plan = self.aim(engine, player)
+        weapon_name, angle, power, target = self.plan
+        names = list(player.weapons.keys())
+        if player.current_weapon != weapon_name:
+            return Action(weapon=names.index(weapon_name) - names.index(player.current_weapon))
+        turn = (angle > player.turret_angle) - (angle < player.turret_angle)
+        push = (power > player.power) - (power < player.power)
+        if turn or push:
+            return Action(angle=turn, power=push)
+        self.plan = None
+        return Action(fire=True, target=target)
+
+    '''
+    Choose a target and weapon and solve for the shot
+    @return the plan as (weapon, turret angle, power, aim point)
+    '''
+    def aim(self, engine, player):
+        enemies = [p for p in engine.players if p is not player and not p.exploding and not p.destroyed]
+        if not enemies:
+            return player.current_weapon, player.turret_angle, player.power, player.rect.center
+        enemies.sort(key=lambda p: abs(p.rect.centerx - player.rect.centerx))
+        error = DIFFICULTIES[self.difficulty]
+        best = None
+        for enemy in enemies[:MAX_TARGETS]:
+            aim_point = (enemy.rect.centerx + self.rng.gauss(0, error), enemy.rect.centery)
+            miss, angle, power, impact = self.solver.solve(player, engine.game_map, aim_point)
+            # Prefer shots that land close, then enemies that are nearly dead
+            score = (miss, enemy.health)
+            if best is None or score < best[0]:
+                best = (score, angle, power, impact, aim_point)
+        _, angle, power, impact, aim_point = best
+        weapon_name = self.choose_weapon(player, impact, aim_point)
+        return weapon_name, angle, power, (int(aim_point[0]), 0)
+
+    '''
+    The most damaging weapon with ammo left whose blast does not reach the
+    computer's own tank
+    '''
+    def choose_weapon(self, player, impact, aim_point):
+        usable = [name for name, ammo in player.weapons.items() if ammo]
+        usable.sort(key=lambda name: weapon.weapons[name]['damage'], reverse=True)
+        for name in usable:
+            # Air strikes come straight down on the aim point, everything else lands at impact
+            landing = aim_point if weapon.weapons[name]['get_path'] is weapon.airstrike_path else impact
+            reach = weapon.weapons[name]['explosion_radius'] + TANK_WIDTH
+            if math.hypot(landing[0] - player.rect.centerx, landing[1] - player.rect.centery) > reach:
+                return name
+        return usable[-1]
+
+    '''
+    Buy the most expensive weapon the computer can afford
+    @return the weapon bought, None if it could not afford any
+    '''
+    def shop(self, player):
+        affordable = [w for w in weapon.weapons if weapon.weapons[w]['gain'] and weapon.weapons[w]['cost'] <= player.total_score]
+        if not affordable:
+            return None
+        item = max(affordable, key=lambda w: weapon.weapons[w]['cost'])
+        player.add_weapon(item)
+        return item
@@ -0,0 +1,196 @@
+import os
+import pygame
+from collections import OrderedDict
+
+'''
+This module holds the process wide caches for everything the game would
+otherwise rebuild every frame (images, composited backgrounds ...).
+The caches live at module level so they survive across rounds, and each
+one is bounded so that a long session does not keep every asset alive.
+'''
+
+# Directory of the game sources, asset paths are resolved against it
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+BACKDROP_COLOR = (200, 200, 200)
+SKY_BLUE = (135, 206, 250)
+BACKGROUND_ALPHA = 200
+
+
+'''
+A small least recently used cache.
+@param capacity is the maximum number of entries kept before the oldest is evicted
+'''
+class LRUCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    Return the entry for key, calling build() to create it on a miss
+    '''
+    def get(self, key, build):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = build()
+            self.entries[key] = value
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return value
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+backgrounds = LRUCache(8)
+# Terrain thumbnails of the saved games shown by the load screen
+thumbnails = LRUCache(64)
+# Tank sprites by (color, turret step), see player.tank_sprite
+tanks = LRUCache(1024)
+# Filled circles (shells and blast frames) by (color, radius, core), and the
+# frames of each blast drawn as them, by (weapon or 'Death', fps)
+discs = LRUCache(1024)
+blasts = LRUCache(64)
+# Transparent in disc sprites, no shell or blast is this color
+DISC_KEY = (255, 0, 255)
+
+# Fonts never change once created, so they are shared by the whole process.
+# Rendered strings are cached by (font, text, color, antialias).
+fonts = {}
+texts = LRUCache(1024)
+
+
+def resolve(path):
+    return path if os.path.isabs(path) else os.path.join(ROOT, path)
+
+
+'''
+Convert a surface to the display pixel format so blitting it is a plain copy.
+Without a display mode (headless runs) the surface is returned as is.
+'''
+def display_format(surface, alpha=False):
+    if pygame.display.get_surface() is None:
+        return surface
+    return surface.convert_alpha() if alpha else surface.convert()
+
+
+'''
+Get the opaque background for a map type, with the backdrop fill and the
+translucent background image already composited into one surface
+@param name is the map type, used with dims as the cache key
+@param path is the background image path relative to the game sources
+@param dims is the (width, height) of the screen
+'''
+def background(name, path, dims):
+    dims = tuple(dims)
+    return backgrounds.get((name, dims), lambda: composite_background(path, dims))
+
+
+def composite_background(path, dims):
+    surface = pygame.Surface(dims)
+    surface.fill(BACKDROP_COLOR)
+    try:
+        image = pygame.transform.scale(pygame.image.load(resolve(path)), dims)
+    except (pygame.error, OSError):
+        image = pygame.Surface(dims)
+        image.fill(SKY_BLUE)
+    image.set_alpha(BACKGROUND_ALPHA)
+    surface.blit(image, (0, 0))
+    return display_format(surface)
+
+
+'''
+Get a small picture of a terrain, sky above and ground below
+@param key identifies the terrain (e.g. save file and mtime) in the cache
+@param heights are terrain heights spread evenly across the map
+@param color is the ground color
+@param height is the height of the map the heights are measured in
+@param dims is the (width, height) of the thumbnail
+'''
+def thumbnail(key, heights, color, height, dims):
+    return thumbnails.get((key, tuple(dims)), lambda: draw_thumbnail(heights, color, height, dims))
+
+
+def draw_thumbnail(heights, color, height, dims):
+    surface = pygame.Surface(dims)
+    surface.fill(SKY_BLUE)
+    width = dims[0] - 1
+    points = [(i*width/max(len(heights) - 1, 1), h*dims[1]/height) for i, h in enumerate(heights)]
+    pygame.draw.polygon(surface, color, points + [(width, dims[1]), (0, dims[1])])
+    return display_format(surface)
+
+
+'''
+Get a filled circle sprite, drawn exactly like pygame.draw.circle would
+@param core is an optional (color, radius) circle drawn inside it
+@return the sprite, whose center is at (radius, radius)
+'''
+def disc(color, radius, core=None):
+    return discs.get((tuple(color), radius, core), lambda: draw_disc(color, radius, core))
+
+
+def draw_disc(color, radius, core):
+    surface = pygame.Surface((2*radius + 2, 2*radius + 2))
+    surface.fill(DISC_KEY)
+    surface.set_colorkey(DISC_KEY, pygame.RLEACCEL)
+    pygame.draw.circle(surface, color, (radius, radius), radius)
+    if core is not None:
+        pygame.draw.circle(surface, core[0], (radius, radius), core[1])
+    return display_format(surface)
+
+
+'''
+Get the sprites of every frame of a blast
+@param name and fps are the weapon (or 'Death') and fps of a weapon.Blast,
+which is the same for every impact of a weapon, so its sprites are drawn once
+and found again by the same short key weapon.explode uses
+@param frames are the blast's (color, radius) frames
+@return a (sprite, radius) per frame
+'''
+def blast(name, fps, frames):
+    return blasts.get((name, fps), lambda: [(disc(color, radius), radius) for color, radius in frames])
+
+
+'''
+Get the shared font for a given spec, creating it on first use
+'''
+def font(name, size, bold=False, italic=False, underline=False):
+    key = (name, size, bold, italic, underline)
+    try:
+        return fonts[key]
+    except KeyError:
+        new_font = pygame.font.SysFont(name, size, bold, italic)
+        new_font.set_underline(underline)
+        fonts[key] = new_font
+        return new_font
+
+
+'''
+Render a string with a shared font, reusing the surface if the same string
+was rendered before
+@param spec is the tuple of font() arguments e.g. ('Arial', 13, True)
+@return the rendered text surface, which callers must not modify
+'''
+def text(spec, string, color, antialias=True):
+    color = tuple(color)
+    return texts.get((spec, string, color, antialias),
+                     lambda: font(*spec).render(string, antialias, color))
+
+
+'''
+Hit and miss counters of the text cache, for profiling
+'''
+def text_stats():
+    return {'hits': texts.hits, 'misses': texts.misses, 'size': len(texts), 'fonts': len(fonts)}
@@ -0,0 +1,108 @@
+import os
+import sys
+import queue
+import threading
+from Tanks import savefile
+
+'''
+Saving without holding up the game.
+
+The game loop only takes a savefile.Snapshot of the game, a copy of the
+terrain and of each player's fields, and hands it to the Writer. The Writer's
+thread packs it and writes it to disk (see savefile.save_snapshot, which
+never leaves a half written file behind), so the frame loop never waits on
+the disk.
+
+An Autosaver saves the game after every turn and every store visit into
+AUTOSAVE_SLOTS files it takes in turn, so the last few autosaves are kept.
+'''
+
+AUTOSAVE_SLOTS = 3
+AUTOSAVE_NAME = 'autosave-{}' + savefile.EXTENSION
+
+
+'''
+Writes snapshots to disk on a background thread, in the order they were
+submitted. The thread is started on the first submit.
+'''
+class Writer:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        # The error of the last write that failed, if any
+        self.error = None
+
+    '''
+    Queue a snapshot to be written to path, without waiting for it
+    '''
+    def submit(self, path, state):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='save writer', daemon=True)
+            self.thread.start()
+        self.queue.put((path, state))
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                savefile.save_snapshot(*job)
+            except Exception as e:
+                # Whatever goes wrong with one save, the thread lives on for the next
+                self.error = e
+                sys.stderr.write('Could not save {}: {}\n'.format(job[0], e))
+            finally:
+                self.queue.task_done()
+
+    '''
+    Wait until everything submitted so far is on disk
+    '''
+    def flush(self):
+        self.queue.join()
+
+    '''
+    Write out what is left and stop the thread
+    '''
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+# The writer of the running game
+writer = Writer()
+
+
+class Autosaver:
+    '''
+    @param directory is where the autosaves go
+    @param slots is how many autosaves are kept
+    '''
+    def __init__(self, directory, slots=AUTOSAVE_SLOTS, writer=writer):
+        self.directory = directory
+        self.slots = slots
+        self.writer = writer
+        # Carry on after the newest autosave left by an earlier game
+        times = [self.mtime(slot) for slot in range(slots)]
+        self.slot = (times.index(max(times)) + 1) % slots if any(times) else 0
+
+    def path(self, slot):
+        return os.path.join(self.directory, AUTOSAVE_NAME.format(slot + 1))
+
+    def mtime(self, slot):
+        try:
+            return os.path.getmtime(self.path(slot))
+        except OSError:
+            return 0
+
+    '''
+    Autosave the game into the next slot, overwriting the oldest autosave
+    @return the path the autosave goes to
+    '''
+    def save(self, game_map, players, round_num):
+        path = self.path(self.slot)
+        self.writer.submit(path, savefile.snapshot(game_map, players, round_num))
+        self.slot = (self.slot + 1) % self.slots
+        return path
@@ -0,0 +1,208 @@
+import os
+import math
+import hashlib
+import numpy as np
+from Tanks import assets
+
+'''
+Precomputed ballistic tables.
+
+A regular shot only depends on the turret angle and the power once fps and
+the physics constants in weapon.py are fixed. The turret turns in steps of
+weapon.angle_step and the power moves in whole steps, so nearly every shot
+fired is one of (steps + 1) x (max_power + 1) arcs. An ArcTable integrates
+each of those once, with no terrain in the way, and keeps them packed end to
+end as the distances covered from the turret at each step. A shot then costs
+a lookup, truncating start + distance into pixels as weapon.trajectories
+does, plus a scan for the first point where the arc meets the terrain.
+The integrator adds each step onto the start instead, which can round
+differently, so where a distance is within ROUNDING of a whole number of
+pixels start + distance could truncate to the other side of it. Shots that
+pass such a point are left to the integrator.
+
+Tables are built the first time they are needed and cached in memory and on
+disk under CACHE_DIR. The file name is a hash of everything the arcs depend
+on, so changing a physics constant simply builds (and caches) a new table.
+'''
+
+CACHE_DIR = os.path.join(assets.ROOT, 'cache')
+# Bump when the layout of the cached files changes
+# Format 2: float distances instead of int16 pixel offsets
+FORMAT = 2
+MAX_POWER = 100
+# An arc ends once it has dropped or travelled this far from the turret, past
+# where shells on the map land. Shells that get further are integrated instead
+MAX_DROP = 1024
+MAX_REACH = 2048
+# No table is made when time steps are so short (fps so high) that an arc
+# would need more steps than this
+MAX_ARC_STEPS = 4096
+# Far more than the rounding of a few thousand float64 sums of screen sized
+# numbers, far less than the gap between a shell and the next pixel
+ROUNDING = 1e-6
+
+tables = {}
+
+
+'''
+The free flight arcs of every (angle step, power) pair.
+Arc i starts at offsets[i] in xs/ys, holds the distance of the shell from
+where it was fired at each step (beginning with (0, 0)) and ends at offsets[i + 1].
+The shell flies at v_x[i] across, and at v_ys[j] down at pixel j of the arc.
+'''
+class ArcTable:
+    def __init__(self, key, offsets, xs, ys, v_x, v_ys):
+        self.key = key
+        self.velocity_scale, self.g, self.time_unit, self.angle_step, self.steps, self.max_power = key[1:]
+        self.offsets = offsets
+        self.xs = xs
+        self.ys = ys
+        self.v_x = v_x
+        self.v_ys = v_ys
+        # Running count of the points whose distance is too close to a whole
+        # number of pixels to trust (exact zeros add up the same either way)
+        near = np.zeros(len(xs), dtype=bool)
+        for distances in (xs, ys):
+            near |= (np.abs(distances - np.rint(distances)) < ROUNDING) & (distances != 0)
+        self.edges = np.zeros(len(xs) + 1, dtype=int)
+        np.cumsum(near, out=self.edges[1:])
+
+    '''
+    @return the index of the arc of each (angle, power) shot, -1 for shots
+    that are not one of the tabulated ones
+    '''
+    def index(self, angles, powers):
+        indices = []
+        for angle, power in zip(angles, powers):
+            step = round(angle/self.angle_step)
+            if 0 <= step <= self.steps and abs(angle - step*self.angle_step) <= 1e-9 and 0 <= power <= self.max_power and power == int(power):
+                indices.append(step*(self.max_power + 1) + int(power))
+            else:
+                indices.append(-1)
+        return np.array(indices, dtype=int)
+
+    '''
+    Fly shells along their arcs over the terrain, stopping them like
+    weapon.trajectories does. All the arcs are scanned at once, end to end.
+    @param indices are the arcs, start_x and start_y where the shells start
+    @return (stopped, columns, rows, starts, steps, v_y): stopped tells the
+    shells that came down before their arc ran out (all of them on a real
+    map) and never came within ROUNDING of a pixel edge. For those, shell i's pixels are columns/rows[starts[i]:starts[i] + steps[i]]
+    and v_y[i] is how fast it was falling at the last one
+    '''
+    def fly(self, indices, start_x, start_y, terrain):
+        width = len(terrain)
+        firsts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - firsts
+        if len(indices) == 1:
+            gather = slice(firsts[0], firsts[0] + lengths[0])
+            starts = np.zeros(1, dtype=int)
+        else:
+            starts = np.zeros(len(indices), dtype=int)
+            np.cumsum(lengths[:-1], out=starts[1:])
+            gather = np.arange(lengths.sum()) + np.repeat(firsts - starts, lengths)
+        columns = np.trunc(np.repeat(start_x, lengths) + self.xs[gather]).astype(int)
+        rows = np.trunc(np.repeat(start_y, lengths) + self.ys[gather]).astype(int)
+        inside = (columns < width) & (columns >= -width)
+        stops = np.flatnonzero(~inside | (rows >= terrain[np.where(inside, columns, 0)]))
+        # The first stop in each arc, if there is one
+        first_stops = stops[np.minimum(np.searchsorted(stops, starts), len(stops) - 1)] if len(stops) else starts - 1
+        stopped = (first_stops >= starts) & (first_stops < starts + lengths)
+        # Leaving the terrain drops the step, landing keeps it
+        steps = np.where(stopped, first_stops - starts + inside[first_stops], 1)
+        # Up to and with the point that stopped the shell
+        stopped &= self.edges[firsts + np.where(stopped, first_stops - starts + 1, 0)] == self.edges[firsts]
+        return stopped, columns, rows, starts, steps, self.v_ys[firsts + steps - 1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            np.savez(f, key=np.array(repr(self.key)), offsets=self.offsets, xs=self.xs, ys=self.ys, v_x=self.v_x, v_ys=self.v_ys)
+        os.replace(temp, path)
+
+    @staticmethod
+    def build(key):
+        velocity_scale, g, time_unit, angle_step, steps, max_power = key[1:]
+        drop = 0.5*g*time_unit**2
+        fall = g*time_unit
+        arcs_x = []
+        arcs_y = []
+        arcs_v_x = []
+        arcs_v_y = []
+        for step in range(steps + 1):
+            angle = math.pi - step*angle_step
+            for power in range(max_power + 1):
+                v_x = velocity_scale*power*math.cos(angle)
+                v_y = -velocity_scale*power*math.sin(angle)
+                arcs_v_x.append(v_x)
+                # Long enough to leave the box, same sums as weapon.trajectories
+                count = _flight_steps(v_x, v_y, g, time_unit)
+                xs = np.empty(count + 1)
+                xs[0] = 0
+                xs[1:] = v_x*time_unit
+                v_ys = np.empty(count + 1)
+                v_ys[0] = v_y
+                v_ys[1:] = fall
+                v_ys = np.add.accumulate(v_ys)
+                ys = np.empty(2*count + 1)
+                ys[0] = 0
+                ys[1::2] = v_ys[:-1]*time_unit
+                ys[2::2] = drop
+                arcs_x.append(np.add.accumulate(xs))
+                arcs_y.append(np.add.accumulate(ys)[::2])
+                arcs_v_y.append(v_ys)
+        offsets = np.zeros(len(arcs_x) + 1, dtype=np.int64)
+        np.cumsum([len(arc) for arc in arcs_x], out=offsets[1:])
+        return ArcTable(key, offsets, np.concatenate(arcs_x), np.concatenate(arcs_y), np.array(arcs_v_x), np.concatenate(arcs_v_y))
+
+    @staticmethod
+    def load(path, key):
+        with np.load(path) as data:
+            if str(data['key']) != repr(key):
+                return None
+            return ArcTable(key, data['offsets'], data['xs'], data['ys'], data['v_x'], data['v_ys'])
+
+
+'''
+Number of time steps until a shell with this velocity is MAX_DROP below or
+MAX_REACH beside its start
+'''
+def _flight_steps(v_x, v_y, g, time_unit):
+    # Solve v_y*t + g*t**2/2 = MAX_DROP
+    t_drop = (-v_y + math.sqrt(v_y**2 + 2*g*MAX_DROP))/g
+    t_reach = MAX_REACH/abs(v_x) if v_x else t_drop
+    return int(math.ceil(min(t_drop, t_reach)/time_unit)) + 1
+
+
+'''
+The table for these physics constants, from memory, the disk cache or
+built from scratch (and then written to the disk cache)
+@return None if the arcs would be too long to tabulate (see MAX_ARC_STEPS)
+'''
+def table(velocity_scale, g, time_unit, angle_step, max_power=MAX_POWER):
+    key = (FORMAT, velocity_scale, g, time_unit, angle_step, int(round(math.pi/angle_step)), max_power)
+    if key in tables:
+        return tables[key]
+    # The longest arc is the one fired straight up at full power
+    if _flight_steps(0, -velocity_scale*max_power, g, time_unit) > MAX_ARC_STEPS:
+        tables[key] = None
+        return None
+    path = os.path.join(CACHE_DIR, 'arcs-' + hashlib.sha1(repr(key).encode()).hexdigest()[:16] + '.npz')
+    arcs = None
+    try:
+        arcs = ArcTable.load(path, key)
+    except (OSError, ValueError, KeyError):
+        pass
+    if arcs is None:
+        arcs = ArcTable.build(key)
+        try:
+            arcs.dump(path)
+        except OSError:
+            # A read only install still gets the in memory table
+            pass
+    tables[key] = arcs
+    return arcs
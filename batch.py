@@ -0,0 +1,291 @@
+'''
+Plays batches of complete matches headless, to tune the prices and damage
+in weapon.weapons and weapon.upgrades without playing by hand.
+A match is a number of rounds, each followed by a visit to the store and a
+new map, just like main() in game.py.
+Matches are spread over a process pool, each one played from its own seed,
+and results are streamed as they come in. Run from the parent directory of
+the source files, e.g.
+
+        python3 -m Tanks.batch --matches 2000 --players 3 --rounds 5 --csv matches.csv --json summary.json
+'''
+import os
+# The engine's tanks and map are built on pygame (see engine.py), no window is opened
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import csv
+import functools
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from Tanks import weapon, ai
+from Tanks.engine import Action, Engine
+from Tanks.map import Map, world_width
+from Tanks.player import Player, TURRET_SPEED
+
+SCREEN_DIMS = (700, 500)
+FPS = 30
+COLORS = [(255, 0, 0), (50, 180, 0), (255, 255, 0), (0, 0, 255), (0, 0, 0)]
+
+
+'''
+POLICIES
+
+A policy plays the seat of one player: act() returns that player's Action
+for the current tick and shop() spends their money at the end of a round.
+Both get the match's random.Random so every match replays from its seed.
+'''
+
+class RandomPolicy:
+    def __init__(self, rng):
+        self.rng = rng
+
+    def act(self, engine):
+        player = engine.current_player()
+        if not player.weapons[player.current_weapon]:
+            return Action(weapon=1)
+        if self.rng.random() < 0.05:
+            return Action(fire=True, target=(self.rng.randrange(engine.game_map.width), 0))
+        return Action(move=self.rng.choice([-1, 0, 0, 1]), angle=self.rng.choice([-1, 0, 1]),
+                      power=self.rng.choice([-1, 1, 1]), weapon=self.rng.choice([0]*20 + [1]))
+
+    def shop(self, player):
+        items = list(weapon.weapons.keys()) + list(weapon.upgrades.keys())
+        for _ in range(3):
+            item = self.rng.choice(items)
+            if item in weapon.weapons:
+                player.add_weapon(item)
+            else:
+                player.upgrade(item)
+
+
+'''
+Aims at 45 degrees towards the closest enemy with the power that would reach
+it on flat ground, fires the most expensive weapon it has ammo for and buys
+the most expensive weapon it can afford
+'''
+class ScriptedPolicy:
+    def __init__(self, rng):
+        self.rng = rng
+
+    def act(self, engine):
+        player = engine.current_player()
+        best = max((w for w, ammo in player.weapons.items() if ammo), key=lambda w: weapon.weapons[w]['cost'])
+        if best != player.current_weapon:
+            return Action(weapon=1)
+        enemies = [p for p in engine.players if p is not player and not p.exploding]
+        if not enemies:
+            return Action(fire=True)
+        enemy = min(enemies, key=lambda p: abs(p.rect.centerx - player.rect.centerx))
+        distance = enemy.rect.centerx - player.rect.centerx
+        # Turret angle 0 fires to the left and pi to the right
+        angle_step = 15 if distance > 0 else 5
+        power = min(math.sqrt(abs(distance)*weapon.g)/weapon.velocity_scale_factor, player.health)
+        turn = angle_step - int(round(player.turret_angle/TURRET_SPEED))
+        push = int(round(power)) - int(player.power)
+        if turn or push:
+            return Action(angle=(turn > 0) - (turn < 0), power=(push > 0) - (push < 0))
+        return Action(fire=True, target=enemy.rect.center)
+
+    def shop(self, player):
+        affordable = [w for w in weapon.weapons if weapon.weapons[w]['cost'] <= player.total_score and weapon.weapons[w]['gain']]
+        if affordable:
+            player.add_weapon(max(affordable, key=lambda w: weapon.weapons[w]['cost']))
+
+
+POLICIES = {'random': RandomPolicy, 'scripted': ScriptedPolicy}
+# The computer players of the game, e.g. ai-hard
+for level in ai.DIFFICULTIES:
+    POLICIES['ai-' + level.lower()] = functools.partial(ai.Computer, level)
+
+
+'''
+Play one complete match
+@param policies is the list of policy names, one per seat
+@return a summary dict with the outcome of every round and every player
+'''
+def play_match(seed, policies, rounds, map_type='Random', max_ticks=5000):
+    rng = random.Random(seed)
+    game_map = Map(None, map_type, SCREEN_DIMS, rng, world_width(len(policies), SCREEN_DIMS[0]))
+    players = []
+    seats = {}
+    for i, policy in enumerate(policies):
+        x = int((i + 1)*game_map.width/(len(policies) + 1))
+        player = Player(None, game_map, 'Player ' + str(i + 1), COLORS[i % len(COLORS)], x, game_map.height(x), SCREEN_DIMS, FPS)
+        players.append(player)
+        seats[player.name] = {'policy': policy, 'rounds_won': 0, 'shots': {}, 'kills': {}}
+    controllers = {player.name: POLICIES[policy](rng) for player, policy in zip(players, policies)}
+
+    round_ticks = []
+    for round_num in range(rounds):
+        engine = Engine(game_map, players)
+        ticks = 0
+        while not engine.game_ended() and ticks < max_ticks:
+            shooter = engine.current_player()
+            standing = [p for p in players if not p.exploding]
+            if engine.act(controllers[shooter.name].act(engine)):
+                used = shooter.current_weapon
+                engine.resolve()
+                stats = seats[shooter.name]
+                stats['shots'][used] = stats['shots'].get(used, 0) + 1
+                killed = sum(1 for p in standing if p.exploding and p is not shooter)
+                if killed:
+                    stats['kills'][used] = stats['kills'].get(used, 0) + killed
+            ticks += 1
+        round_ticks.append(ticks)
+        survivors = [p for p in players if not p.exploding]
+        if len(survivors) == 1:
+            seats[survivors[0].name]['rounds_won'] += 1
+
+        # The store, then a new map like main() does
+        for player in players:
+            controllers[player.name].shop(player)
+        game_map = Map(None, 'Random', SCREEN_DIMS, rng, world_width(len(players), SCREEN_DIMS[0]))
+        for player in players:
+            player.reset_player_stats(game_map)
+        rng.shuffle(players)
+
+    for player in players:
+        seats[player.name]['total_score'] = player.total_score
+    winner = max(players, key=lambda p: (seats[p.name]['rounds_won'], p.total_score))
+    return {'seed': seed, 'winner': winner.name, 'round_ticks': round_ticks, 'players': seats}
+
+
+def play_matches(seeds, policies, rounds, map_type, max_ticks):
+    return [play_match(seed, policies, rounds, map_type, max_ticks) for seed in seeds]
+
+
+'''
+Running totals over all matches played so far
+'''
+class Summary:
+    def __init__(self):
+        self.matches = 0
+        self.rounds = 0
+        self.round_ticks = 0
+        self.players = 0
+        self.total_score = 0
+        self.weapons = {}
+        self.policies = {}
+
+    def add(self, match):
+        self.matches += 1
+        self.rounds += len(match['round_ticks'])
+        self.round_ticks += sum(match['round_ticks'])
+        for name, seat in match['players'].items():
+            won = name == match['winner']
+            self.players += 1
+            self.total_score += seat['total_score']
+            policy = self.policies.setdefault(seat['policy'], {'seats': 0, 'wins': 0})
+            policy['seats'] += 1
+            policy['wins'] += won
+            for used, shots in seat['shots'].items():
+                stats = self.weapons.setdefault(used, {'shots': 0, 'kills': 0, 'seats': 0, 'wins': 0})
+                stats['shots'] += shots
+                stats['kills'] += seat['kills'].get(used, 0)
+                stats['seats'] += 1
+                stats['wins'] += won
+
+    '''
+    @return the aggregate as a json friendly dict. A weapon's win_rate is the
+    share of seats that fired it at least once and went on to win the match
+    '''
+    def result(self):
+        weapons = {}
+        for name, stats in sorted(self.weapons.items()):
+            weapons[name] = dict(stats, kills_per_shot=stats['kills']/stats['shots'], win_rate=stats['wins']/stats['seats'])
+        return {'matches': self.matches,
+                'average_total_score': self.total_score/max(self.players, 1),
+                'average_round_ticks': self.round_ticks/max(self.rounds, 1),
+                'policies': {name: dict(stats, win_rate=stats['wins']/stats['seats']) for name, stats in self.policies.items()},
+                'weapons': weapons}
+
+
+CSV_FIELDS = ['seed', 'player', 'policy', 'won', 'rounds_won', 'total_score', 'shots', 'kills', 'round_ticks']
+
+def csv_rows(match):
+    for name, seat in sorted(match['players'].items()):
+        yield {'seed': match['seed'], 'player': name, 'policy': seat['policy'], 'won': int(name == match['winner']),
+               'rounds_won': seat['rounds_won'], 'total_score': seat['total_score'],
+               'shots': json.dumps(seat['shots'], sort_keys=True), 'kills': json.dumps(seat['kills'], sort_keys=True),
+               'round_ticks': ' '.join(map(str, match['round_ticks']))}
+
+
+'''
+Play the matches over a process pool, handing each worker chunks of seeds
+and keeping a bounded number of chunks in flight
+'''
+def run(args, out=None):
+    policies = (args.policies * args.players)[:args.players]
+    seeds = [args.seed + i for i in range(args.matches)]
+    chunks = [seeds[i:i + args.chunk] for i in range(0, len(seeds), args.chunk)]
+    summary = Summary()
+    writer = None
+    if out is not None:
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+    workers = args.jobs or os.cpu_count()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        queue = iter(chunks)
+        while True:
+            for chunk in queue:
+                pending.add(pool.submit(play_matches, chunk, policies, args.rounds, args.map, args.max_ticks))
+                if len(pending) >= 4*workers:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for match in future.result():
+                    summary.add(match)
+                    if writer:
+                        writer.writerows(csv_rows(match))
+            if out is not None:
+                out.flush()
+            if args.progress:
+                sys.stderr.write('\r{} / {} matches, {:.1f} s'.format(summary.matches, args.matches, time.perf_counter() - start))
+    if args.progress:
+        sys.stderr.write('\n')
+    result = summary.result()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play batches of headless Battle Tanks matches')
+    parser.add_argument('--matches', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--policies', nargs='+', choices=sorted(POLICIES), default=['scripted'],
+                        help='policy per seat, repeated to fill every seat')
+    parser.add_argument('--map', default='Random', choices=['Random', 'Snow', 'Hill', 'Desert', 'Moon'])
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first match, the others follow on')
+    parser.add_argument('--max-ticks', type=int, default=5000, help='ticks after which a round is called off')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--chunk', type=int, default=8, help='matches per task sent to a worker')
+    parser.add_argument('--csv', help='stream one row per player and match to this file')
+    parser.add_argument('--json', help='write the aggregate to this file instead of stdout')
+    parser.add_argument('--progress', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as out:
+            result = run(args, out)
+    else:
+        result = run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,433 @@
+'''
+Benchmarks for the hot paths of the game, headless. Run them from the parent
+directory of the source files with
+
+        python3 -m Tanks.bench                          run every case
+        python3 -m Tanks.bench terrain map.draw         only the cases whose name contains one of these
+        python3 -m Tanks.bench --save baseline.json     also save the results as a baseline
+        python3 -m Tanks.bench --baseline baseline.json fail (exit status 1) on cases slower
+                                                        than the baseline by more than --threshold
+        python3 -m Tanks.bench --craters                list vs numpy crater carving
+        python3 -m Tanks.bench --parity                 shot pixels vs the original integrator
+
+Each case is timed in several runs of enough calls to take about
+--run-time seconds. The fastest run is the one compared against the
+baseline, as it is the one least disturbed by whatever else the machine is
+doing, while the median and spread show how noisy the timing was.
+'''
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import argparse
+import glob
+import io
+import itertools
+import json
+import math
+import random
+import statistics
+import sys
+import time
+import timeit
+import warnings
+from collections import OrderedDict
+import numpy as np
+import pygame
+from Tanks import utils, weapon, game, assets, savefile
+from Tanks.ai import Computer
+from Tanks.batch import ScriptedPolicy
+from Tanks.engine import Engine
+from Tanks.gamestats import Gamestats
+from Tanks.map import Map
+from Tanks.player import Player
+from Tanks.renderer import Renderer
+
+SCREEN_DIMS = (700, 500)
+FPS = 30
+MAP_TYPES = ['Snow', 'Hill', 'Desert', 'Moon']
+SAVES = os.path.join(assets.ROOT, 'saved_games', '*.txt')
+
+
+'''
+CASES
+
+A case is a function that does its setup and returns the callable to time.
+Cases are registered under a dotted name, families of cases (one per weapon,
+terrain ...) get one name each.
+'''
+cases = OrderedDict()
+
+def case(name):
+    def register(setup):
+        cases[name] = setup
+        return setup
+    return register
+
+
+def new_map(type='Hill', screen=None, seed=0, width=None):
+    return Map(screen, type, SCREEN_DIMS, random.Random(seed), width)
+
+def new_players(game_map, count, screen=None):
+    players = []
+    for i in range(count):
+        x = int((i + 1)*game_map.width/(count + 1))
+        players.append(Player(screen, game_map, 'Player ' + str(i + 1), game.RED, x, game_map.height(x), SCREEN_DIMS, FPS))
+    return players
+
+def screen():
+    return pygame.display.get_surface() or pygame.display.set_mode(SCREEN_DIMS)
+
+
+# A representative shot: from the left third of a hill, 45 degrees, 60 power
+SHOT_X = SCREEN_DIMS[0] // 3
+SHOT_ANGLE = 15*weapon.angle_step
+SHOT_POWER = 60
+
+@case('weapon.trajectory')
+def trajectory_case():
+    terrain = new_map().get_terrain()
+    start = (SHOT_X, terrain[SHOT_X] - 10)
+    return lambda: weapon.trajectory(start, FPS, SHOT_POWER, SHOT_ANGLE, terrain)
+
+@case('weapon.impacts.x100')
+def impacts_case():
+    terrain = new_map().get_terrain()
+    starts = [(SHOT_X, terrain[SHOT_X] - 10)]*100
+    powers = [power for power in range(0, 100, 10) for _ in range(10)]
+    angles = [step*weapon.angle_step for _ in range(10) for step in range(5, 15)]
+    return lambda: weapon.impacts(starts, FPS, powers, angles, terrain)
+
+# One case per path function, the shells are flown until every one has landed
+for path in sorted({stats['get_path'] for stats in weapon.weapons.values()}, key=lambda f: f.__name__):
+    def path_case(path=path):
+        terrain = new_map().get_terrain()
+        start = (SHOT_X, terrain[SHOT_X] - 10)
+        target = (2*SCREEN_DIMS[0]//3, 0)
+        def fly():
+            flights = list(path(start, FPS, SHOT_POWER, SHOT_ANGLE, terrain, target))
+            while flights:
+                flights = [spawned for flight in flights for spawned in flight.land(terrain)]
+        return fly
+    case('get_path.' + path.__name__)(path_case)
+
+@case('weapon.explode')
+def explode_case():
+    types = list(weapon.weapons) + ['Death']
+    return lambda: [weapon.explode(type, FPS) for type in types]
+
+@case('weapon.explode.uncached')
+def blast_case():
+    types = list(weapon.weapons) + ['Death']
+    return lambda: [weapon._blast(type, FPS) for type in types]
+
+# One crater per distinct blast radius, on a fresh copy of the terrain each time
+for radius in sorted({stats['explosion_radius'] for stats in weapon.weapons.values()} | {weapon.explode('Death', FPS).max_radius}):
+    def crater_case(radius=radius):
+        game_map = new_map()
+        initial = game_map.get_terrain().copy()
+        center = (SCREEN_DIMS[0]//2, int(game_map.height(SCREEN_DIMS[0]//2)))
+        def carve():
+            game_map.get_terrain()[:] = initial
+            game_map.apply_damage(center, radius)
+        return carve
+    case('map.apply_damage.r' + str(radius))(crater_case)
+
+for map_type in MAP_TYPES:
+    def terrain_case(map_type=map_type):
+        game_map = new_map(map_type)
+        generate = game_map.maps[map_type]['terrain']
+        return lambda: generate(SCREEN_DIMS, SCREEN_DIMS[0])
+    case('map.terrain.' + map_type.lower())(terrain_case)
+
+@case('map.draw')
+def map_draw_case():
+    game_map = new_map(screen=screen())
+    return game_map.draw
+
+@case('map.render')
+def map_render_case():
+    game_map = new_map(screen=screen())
+    return game_map.render
+
+for count in (2, 10, 100):
+    def draw_case(count=count):
+        surface = screen()
+        game_map = new_map(screen=surface)
+        players = new_players(game_map, count, surface)
+        renderer = Renderer(surface)
+        return lambda: game.draw_elements(surface, game_map, players, 0, 1, renderer)
+    case('game.draw_elements.' + str(count))(draw_case)
+
+# A large battle scrolled across: the cost of a frame should not grow with the width
+for width in (7000, 50000):
+    def wide_case(width=width):
+        surface = screen()
+        game_map = new_map(screen=surface, width=width)
+        players = new_players(game_map, 300, surface)
+        renderer = Renderer(surface)
+        views = itertools.cycle(range(0, width - SCREEN_DIMS[0], 97))
+        return lambda: game.draw_elements(surface, game_map, players, 0, 1, renderer, next(views))
+    case('game.draw_elements.wide.' + str(width))(wide_case)
+
+# A Nuke Shower going off: five shells in the air and five blasts at every frame of theirs
+@case('game.draw_frame.nuke_shower')
+def draw_frame_case():
+    surface = screen()
+    game_map = new_map(screen=surface)
+    players = new_players(game_map, 2, surface)
+    engine = Engine(game_map, players)
+    renderer = Renderer(surface)
+    frames = assets.blast('Nuke Shower', FPS, weapon.explode('Nuke Shower', FPS).frames)
+    shells = {i: ((100*i + 140, 100), (100*i + 142, 103)) for i in range(5)}
+    blasts = [[[(100*i + 150, 300), frames, index] for i in range(5)] for index in range(len(frames))]
+    def draw():
+        for explosions in blasts:
+            game.draw_frame(surface, engine, shells, explosions, 0.5, 1, renderer)
+    return draw
+
+@case('gamestats.draw')
+def gamestats_case():
+    surface = screen()
+    stats = Gamestats(surface, SCREEN_DIMS)
+    player = new_players(new_map(), 1)[0]
+    return lambda: stats.draw(player)
+
+for path in sorted(glob.glob(SAVES)):
+    def text_case(path=path):
+        with open(path) as f:
+            text = f.read()
+        return lambda: savefile.read_text(io.StringIO(text), None, SCREEN_DIMS, game.SIM_HZ)
+
+    def binary_case(path=path):
+        with open(path) as f:
+            players, game_map, _ = savefile.read_text(f, None, SCREEN_DIMS, game.SIM_HZ)
+        def round_trip():
+            f = io.BytesIO()
+            savefile.write(f, game_map, players)
+            savefile.read(f.getbuffer(), None, SCREEN_DIMS, game.SIM_HZ)
+        return round_trip
+    name = os.path.splitext(os.path.basename(path))[0]
+    case('save.load_text.' + name)(text_case)
+    case('save.round_trip.' + name)(binary_case)
+
+@case('ai.plan')
+def ai_case():
+    game_map = new_map()
+    players = new_players(game_map, 4)
+    engine = Engine(game_map, players)
+    def plan():
+        # A new computer each time, so nothing is memoized between runs
+        computer = Computer('Hard', random.Random(0))
+        computer.aim(engine, players[0])
+    return plan
+
+# Macro benchmark: a whole headless round of four scripted players
+@case('round.headless.4')
+def round_case():
+    def play():
+        rng = random.Random(0)
+        game_map = new_map(seed=0)
+        players = new_players(game_map, 4)
+        policy = ScriptedPolicy(rng)
+        Engine(game_map, players).play(policy.act, 2000)
+    return play
+
+
+'''
+RUNNING
+'''
+
+'''
+Time one case
+@return a dict of per call statistics in seconds
+'''
+def measure(setup, repeat=7, run_time=0.05):
+    run = setup()
+    run()
+    # Find how many calls fill a run
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= run_time:
+            break
+        number = number*2 if elapsed == 0 else max(number*2, int(number*run_time/elapsed) + 1)
+    times = [elapsed/number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - start)/number)
+    return {'best': min(times), 'median': statistics.median(times),
+            'spread': (max(times) - min(times))/min(times), 'calls': number}
+
+'''
+Run the selected cases, printing a line per case as it finishes
+@param baseline is the {case: stats} of an earlier run or None
+@return ({case: stats}, [names of the cases that regressed])
+'''
+def run_cases(names, baseline=None, threshold=0.25, repeat=7, run_time=0.05, out=sys.stdout):
+    results = OrderedDict()
+    regressed = []
+    out.write('{:<30}{:>8}{:>12}{:>12}{:>9}{:>12}{:>9}\n'.format('case', 'calls', 'best us', 'median us', 'spread', 'baseline', 'change'))
+    for name in names:
+        stats = measure(cases[name], repeat, run_time)
+        results[name] = stats
+        line = '{:<30}{:>8}{:>12.1f}{:>12.1f}{:>8.0f}%'.format(name, stats['calls'], stats['best']*1e6, stats['median']*1e6, stats['spread']*100)
+        if baseline and name in baseline:
+            change = stats['best']/baseline[name]['best'] - 1
+            line += '{:>12.1f}{:>+8.0f}%'.format(baseline[name]['best']*1e6, change*100)
+            if change > threshold:
+                regressed.append(name)
+                line += '  REGRESSED'
+        out.write(line + '\n')
+        out.flush()
+    return results, regressed
+
+
+'''
+The column by column crater carving Map.apply_damage used before the
+terrain became a numpy array, kept as the reference for the speedup
+'''
+def list_apply_damage(terrain, screen_dims, center, radius):
+    for x in range(center[0]-radius, center[0]+radius+1):
+        if x<screen_dims[0] and x>0 and utils.dist(center,(x, terrain[x])) <= radius**2:
+            new_height = int(center[1] + math.sqrt(radius**2 - (center[0] - x)**2))
+            if new_height >= terrain[x]:
+                terrain[x] = new_height
+
+
+'''
+Time one crater per weapon blast radius with the list based carving and the
+vectorized Map.apply_damage, both on the same generated terrain
+@return a list of (weapon, radius, list seconds, numpy seconds) per weapon
+'''
+def bench_craters(number=200, repeat=5):
+    game_map = Map(None, 'Hill', SCREEN_DIMS, random.Random(0))
+    center_x = SCREEN_DIMS[0] // 2
+    results = []
+    for name, stats in weapon.weapons.items():
+        radius = stats['explosion_radius']
+        center = (center_x, int(game_map.height(center_x)))
+        initial = game_map.get_terrain().copy()
+        terrain = initial.tolist()
+
+        def carve_list():
+            terrain[:] = initial.tolist()
+            list_apply_damage(terrain, SCREEN_DIMS, center, radius)
+
+        def carve_numpy():
+            game_map.get_terrain()[:] = initial
+            game_map.apply_damage(center, radius)
+
+        list_time = min(timeit.repeat(carve_list, number=number, repeat=repeat)) / number
+        numpy_time = min(timeit.repeat(carve_numpy, number=number, repeat=repeat)) / number
+        if terrain != game_map.get_terrain().tolist():
+            raise AssertionError('Crater mismatch for ' + name)
+        results.append((name, radius, list_time, numpy_time))
+    return results
+
+
+'''
+The one shell at a time integrator weapon.trajectories replaced, kept as the
+reference its pixels have to match. Shells past either end of the terrain
+stop like they do in weapon.trajectories instead of running off the list.
+@return the (x, y) pixels of the shell
+'''
+def list_trajectory(start_pos, fps, initial_velocity, angle, terrain):
+    angle = math.pi - angle
+    v_x = weapon.velocity_scale_factor*initial_velocity * math.cos(angle)
+    v_y = -weapon.velocity_scale_factor*initial_velocity * math.sin(angle)
+    time_unit = weapon.time_resolution/fps
+    pos_x = int(start_pos[0])
+    pos_y = int(start_pos[1])
+    positions = [(pos_x, pos_y)]
+    while int(pos_y) < terrain[int(pos_x)]:
+        pos_x = pos_x + v_x * time_unit
+        if int(pos_x) >= len(terrain) or int(pos_x) < -len(terrain):
+            break
+        pos_y = pos_y + v_y*time_unit + 0.5*weapon.g*time_unit**2
+        v_y = v_y + weapon.g * time_unit
+        positions.append((int(pos_x), int(pos_y)))
+    return positions
+
+
+'''
+Fly random shots, many of them whole turret steps and powers (looked up in
+the arc tables) and many landing off the left end of the map, through
+weapon.trajectories and weapon.impacts and compare their pixels with
+list_trajectory's
+@return (shots, mismatches)
+'''
+def check_trajectories(shots=3000, seed=0):
+    rng = random.Random(seed)
+    terrain = new_map(seed=seed).get_terrain()
+    mismatches = 0
+    for _ in range(shots):
+        x = rng.choice([rng.randrange(0, 80), rng.randrange(SCREEN_DIMS[0])])
+        start = (x, int(terrain[x]) - rng.randrange(1, 40))
+        if rng.random() < 0.7:
+            angle, power = rng.randrange(21)*weapon.angle_step, rng.randrange(101)
+        else:
+            angle, power = rng.uniform(0, math.pi), rng.uniform(0, 100)
+        expected = list_trajectory(start, FPS, power, angle, terrain)
+        flight = weapon.trajectories([start], FPS, [power], [angle], terrain)[0]
+        end = weapon.impacts([start], FPS, [power], [angle], terrain)[0]
+        if list(zip(flight.xs, flight.ys)) != expected or tuple(end) != expected[-1]:
+            mismatches += 1
+    return shots, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of Battle Tanks')
+    parser.add_argument('filters', nargs='*', help='only run the cases whose name contains one of these')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    parser.add_argument('--save', help='write the results to this baseline file')
+    parser.add_argument('--baseline', help='compare against this baseline file')
+    parser.add_argument('--threshold', type=float, default=0.25, help='slowdown past which a case fails (0.25 is 25%%)')
+    parser.add_argument('--repeat', type=int, default=7, help='timed runs per case')
+    parser.add_argument('--run-time', type=float, default=0.05, help='seconds each timed run should take')
+    parser.add_argument('--craters', action='store_true', help='compare the list and numpy crater carving instead')
+    parser.add_argument('--parity', action='store_true', help='check shot pixels against the original integrator instead')
+    args = parser.parse_args(argv)
+
+    if args.craters:
+        print('{:<22}{:>8}{:>12}{:>12}{:>9}'.format('Crater', 'radius', 'list us', 'numpy us', 'speedup'))
+        for name, radius, list_time, numpy_time in bench_craters():
+            print('{:<22}{:>8}{:>12.1f}{:>12.1f}{:>8.1f}x'.format(name, radius, list_time*1e6, numpy_time*1e6, list_time/numpy_time))
+        return 0
+
+    if args.parity:
+        shots, mismatches = check_trajectories()
+        print('{} of {} shots differ from the original integrator'.format(mismatches, shots))
+        return 1 if mismatches else 0
+
+    names = [name for name in cases if not args.filters or any(f in name for f in args.filters)]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+
+    # Fonts missing from the machine fall back to the default, quietly
+    warnings.filterwarnings('ignore', module='pygame.sysfont')
+    pygame.init()
+    screen()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['cases']
+    results, regressed = run_cases(names, baseline, args.threshold, args.repeat, args.run_time)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'numpy': np.__version__,
+                       'pygame': pygame.version.ver, 'cases': results}, f, indent=2)
+    if regressed:
+        print('{} case(s) regressed by more than {:.0f}%: {}'.format(len(regressed), args.threshold*100, ', '.join(regressed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import math
+
+'''
+Which part of the battlefield is on screen, when the battlefield is wider than
+the screen.
+
+The camera only changes what is drawn: the game plays out the same wherever it
+looks, so it is not saved or recorded. It eases towards what it follows (the
+shells of a shot, or the tank whose turn it is) instead of jumping there, and
+never looks past either end of the battlefield.
+'''
+
+# Part of the way to its target the camera moves each frame
+EASE = 0.2
+# While aiming an air strike, the pointer this close to a screen edge pans the
+# camera PAN_SPEED pixels a frame that way
+PAN_EDGE = 40
+PAN_SPEED = 20
+
+
+class Camera:
+    '''
+    @param view_width is the width of the screen
+    @param world_width is the width of the battlefield
+    @param x is the battlefield column to center on
+    '''
+    def __init__(self, view_width, world_width, x=0):
+        self.view_width = view_width
+        self.world_width = world_width
+        self.x = self.clamp(x - view_width/2)
+
+    def clamp(self, x):
+        return int(min(max(x, 0), max(self.world_width - self.view_width, 0)))
+
+    '''
+    Move part of the way to centering on battlefield column x
+    '''
+    def follow(self, x):
+        target = self.clamp(x - self.view_width/2)
+        step = (target - self.x)*EASE
+        self.x = self.clamp(self.x + (math.ceil(step) if step > 0 else math.floor(step)))
+
+    '''
+    Pan towards the screen edge the pointer (in screen coordinates) is at, if any
+    '''
+    def pan(self, pointer):
+        if pointer[0] < PAN_EDGE:
+            self.x = self.clamp(self.x - PAN_SPEED)
+        elif pointer[0] >= self.view_width - PAN_EDGE:
+            self.x = self.clamp(self.x + PAN_SPEED)
+
+    '''
+    @return the battlefield point under a point on screen
+    '''
+    def to_world(self, point):
+        return point[0] + self.x, point[1]
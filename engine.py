@@ -0,0 +1,189 @@
+from collections import namedtuple
+from Tanks.player import TANK_WIDTH
+from Tanks.profiler import profile
+
+'''
+This is the headless part of the game: the rules of a round (turn order,
+firing, shells in flight, damage, scoring and when a round ends) with no
+display, fonts or clock involved. The screens in game.py are a view on top
+of it, and it can play whole rounds on its own as fast as the CPU allows.
+It is not free of pygame though: the tanks and the map it plays on are the
+Player and Map of player.py and map.py, which keep their positions in
+pygame.Rect and their looks in surfaces. So pygame still has to be
+installed to run it, with SDL_VIDEODRIVER=dummy where there is no display
+(see batch.py), but no window is opened and nothing is drawn.
+
+Input comes in as one Action per tick for the player whose turn it is
+-   move   : -1 left, 1 right, 0 stay
+-   angle  : -1/1 to rotate the turret clockwise/counter-clockwise, 0 to hold it
+-   power  : -1/1 to decrease/increase the power, 0 to hold it
+-   weapon : how many weapons to switch forward (negative for backward)
+-   fire   : True to fire the current weapon
+-   target : the (x, y) point aimed at, used by the Precision Air Strike
+-   recharge : True to use a Health Recharge
+'''
+Action = namedtuple('Action', ['move', 'angle', 'power', 'weapon', 'fire', 'target', 'recharge'])
+Action.__new__.__defaults__ = (0, 0, 0, 0, False, None, False)
+IDLE = Action()
+
+
+class Engine:
+    def __init__(self, game_map, players, turn=0):
+        self.game_map = game_map
+        self.players = players
+        self.turn = turn
+        # Shells currently in the air
+        self.flights = []
+        # The action whose movement waits until the shot has landed
+        self.pending = IDLE
+        self.firing = False
+        # Players neither exploding nor destroyed, counted down as they go
+        self.standing = len(players) - sum(1 for p in players if p.exploding or p.destroyed)
+
+    def current_player(self):
+        return self.players[self.turn]
+
+    '''
+    Apply one tick of input for the current player.
+    Without a shot the tick is complete when this returns. When a shot was
+    fired the shells are left in flights, the caller advances them with step()
+    (or all at once with resolve()) and then calls settle() to end the turn.
+    @return True iff a shot was fired
+    '''
+    def act(self, action):
+        player = self.current_player()
+        if action.recharge:
+            player.health_recharge()
+        if action.weapon:
+            player.switch_weapon(action.weapon)
+        fired = bool(action.fire) and self.fire(action.target)
+        # A tank stops driving when it fires
+        self.pending = action._replace(move=0) if fired else action
+        if not fired:
+            self.settle()
+        return fired
+
+    def fire(self, target=None):
+        flights = self.current_player().get_shot_trajectory(target)
+        if not flights:
+            return False
+        self.flights = self.collide(flights)
+        self.firing = True
+        return True
+
+    '''
+    Advance every shell in the air by one frame, applying the damage of those
+    that land. Shells spawned by a landing start flying on the next step.
+    @return (positions, impacts) where impacts holds a (position, explosion
+    radii, crater) tuple for each shell that landed, crater being the terrain
+    columns it changed
+    '''
+    def step(self):
+        player = self.current_player()
+        positions = []
+        impacts = []
+        spawned = []
+        for flight in self.flights:
+            positions.append(next(flight))
+            if not flight:
+                spawned.extend(self.collide(flight.land(self.game_map.get_terrain())))
+                max_radius, radii = player.get_explosion_radii()
+                profile.mark('flight')
+                crater, killed = calculate_and_apply_damage(self.players, self.turn, self.game_map, positions[-1], max_radius)
+                profile.mark('damage')
+                self.standing -= killed
+                impacts.append((positions[-1], radii, crater))
+        self.flights = [f for f in self.flights if f] + spawned
+        profile.mark('flight')
+        return positions, impacts
+
+    '''
+    Cut short the flights that run into a tank on their way, so that a direct
+    hit goes off on contact instead of where the shell would reach the ground
+    @return the flights as a list
+    '''
+    def collide(self, flights):
+        flights = list(flights)
+        for flight in flights:
+            hit = self.game_map.tanks.first_hit(flight.xs, flight.ys)
+            if hit is not None:
+                flight.stop(*hit)
+        return flights
+
+    '''
+    Finish the tick: apply the movement of the last action and, if a shot was
+    fired, pass the turn on to the next player still standing
+    '''
+    def settle(self):
+        action = self.pending
+        self.pending = IDLE
+        self.current_player().move(action.move < 0, action.move > 0, action.angle, action.power > 0, action.power < 0)
+        if self.firing:
+            self.firing = False
+            self.next_turn()
+
+    def next_turn(self):
+        for _ in range(len(self.players)):
+            self.turn = (self.turn + 1) % len(self.players)
+            if not self.players[self.turn].exploding:
+                return
+
+    '''
+    Run the shells of a shot to the ground and end the turn, without animation
+    '''
+    def resolve(self):
+        while self.flights:
+            self.step()
+        self.settle()
+
+    '''
+    Apply a whole tick headless
+    @return True iff a shot was fired
+    '''
+    def tick(self, action):
+        fired = self.act(action)
+        if fired:
+            self.resolve()
+        return fired
+
+    '''
+    The round ends when 1 or fewer players are left standing
+    '''
+    def game_ended(self):
+        return self.standing <= 1
+
+    '''
+    Play until the round ends
+    @param policy is called with the engine every tick and returns the Action
+    of the current player
+    @param max_ticks bounds rounds where nobody manages to finish the others off
+    @return the number of ticks played
+    '''
+    def play(self, policy, max_ticks=100000):
+        ticks = 0
+        while not self.game_ended() and ticks < max_ticks:
+            self.tick(policy(self))
+            ticks += 1
+        return ticks
+
+
+'''
+This function iterates through the players after a missile is fired and updates
+the model (health, live status, score) accordingly.
+Only the tanks the map's spatial index has near the blast are looked at.
+@return (crater, killed): the (first, last) terrain columns the crater
+changed (or None) and how many standing players it finished off
+'''
+
+def calculate_and_apply_damage(players, turn, game_map, position, max_radius):
+    damage = players[turn].get_weapon_damage()
+    crater = game_map.apply_damage(position ,max_radius)
+    killed = 0
+    # A tank is hit by blasts reaching its center or either end
+    for player in game_map.tanks.near(position[0], max_radius + TANK_WIDTH):
+        if player.in_blast_radius(position, max_radius):
+            standing = not (player.exploding or player.destroyed)
+            player.apply_damage(damage)
+            players[turn].add_score(player)
+            killed += standing and player.exploding
+    return crater, killed
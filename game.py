@@ -6,19 +6,49 @@ in this file.
 '''
 import Tanks
 import pygame
-from Tanks.map import Map
+from Tanks.map import Map, NAMED_PLAYERS, world_width
 from Tanks.player import Player
-from Tanks import utils, weapon
+from Tanks.engine import Engine, Action
+from Tanks.renderer import Renderer, DirtyRenderer
+from Tanks.saveindex import SaveIndex
+from Tanks import utils, weapon, assets, ai, profiler, savefile, autosave, replay
+from Tanks.autosave import Autosaver
+from Tanks.camera import Camera
+from Tanks.profiler import profile
 import random
 import os
-import json
 import sys
+import time
 
 # Display
 WIDTH = 700
 HEIGHT = 500
 SCREEN_DIMS = (WIDTH, HEIGHT)
-FPS = 30
+# Frames drawn per second, 0 for as many as the machine can
+FPS = 60
+# The simulation (shells, explosions, tanks) moves on in fixed ticks of its
+# own, so outcomes do not depend on FPS. When frames take too long several
+# ticks run per frame, up to MAX_LAG seconds worth, before the game slows down
+SIM_HZ = 30
+TICK = 1/SIM_HZ
+MAX_LAG = 0.25
+# Push only the changed parts of the screen during play instead of full flips
+DIRTY_RECTS = True
+
+# Large battles: up to MAX_PLAYERS tanks. Only the first NAMED_PLAYERS (see
+# map.py) get to pick a name, color and controller, the rest are computer players
+MAX_PLAYERS = 300
+LARGE_BATTLE_DIFFICULTY = 'Medium'
+# Tanks and blasts further than this off screen are not drawn
+CULL_MARGIN = 64
+# How many of the round scores are listed on screen
+SCOREBOARD_SIZE = 10
+
+# Saved games
+SAVE_DIR = os.path.join(assets.ROOT, 'saved_games')
+SAVES_PER_PAGE = 5
+# Longest line of map, round and scores shown for a save
+SUMMARY_LENGTH = 60
 
 # Colors
 WHITE = (255, 255, 255)
@@ -30,83 +60,99 @@ SKY_BLUE = (135, 206, 250)
 ORANGE = (255, 100, 0)
 YELLOW = (255, 255, 0)
 GRAY = (100,100,100)
+# The air strike targeting cursor
+CURSOR_RADIUS = 6
 GOLD = (255,150,0)
 
 
 '''
-This function reads from the model and updates the view.
-Draws any changes in the screen.
+Advance a shot that is playing out by one simulation tick: move its shells,
+set off an explosion where each one lands and move the explosions on
+@param shells are the shells in the air as {flight: (previous, current position)}
+@param explosions are the blasts going off as [position, frame sprites (from
+assets.blast), frame index], updated in place
+@param view_x is the battlefield column at the left edge of the screen
+@return the shells in the air after the tick
 '''
-def update_view(screen, clock, players, turn, game_map, missile_trajectories, round_num=0):
-    # Draw the view
-    draw_elements(screen, game_map, players, turn, round_num)
-    explosions = []
-    while missile_trajectories or explosions:
-        clock.tick(FPS)
-        # Capture missile positions and explosions in this list
-        positions = []
-        # synthesize the current positions of all missile on the screen
-        for trajectory in missile_trajectories:
-            positions.append(trajectory.pop())
-            if not trajectory:
-                max_radius, radii = players[turn].get_explosion_radii()
-                calculate_and_apply_damage(players, turn, game_map, positions[-1], max_radius)
-                explosions.append([positions[-1],radii])
-
-        # Draw each missile
-        for missile_position in positions:
-            pygame.draw.circle(screen, GRAY , missile_position, players[turn].get_shell_radius())
-            if missile_position[1]%2==0:
-                pygame.draw.circle(screen, RED , missile_position, max(players[turn].get_shell_radius() - 3,0))
-
-        if explosions:
-            for e in explosions:
-                pos = e[0]
-                color, radius = e[1].pop()
-                pygame.draw.circle(screen, color, pos , radius)
-            explosions = [e for e in explosions if e[1]]
+def step_shot(engine, shells, explosions, renderer, view_x=0):
+    flights = list(engine.flights)
+    shooter = engine.current_player()
+    positions, impacts = engine.step()
+    moved = {flight: (shells[flight][1] if flight in shells else position, position)
+             for flight, position in zip(flights, positions)}
+    # Blast frames are shared, so each explosion keeps its own frame count
+    for explosion in explosions:
+        explosion[2] += 1
+    explosions[:] = [e for e in explosions if e[2] < len(e[1])]
+    for position, radii, crater in impacts:
+        if crater:
+            renderer.damage(pygame.Rect(crater[0] - 1 - view_x, 0, crater[1] - crater[0] + 3, HEIGHT))
+        explosions.append([position, assets.blast(shooter.current_weapon, shooter.fps, radii), 0])
+    return moved
 
-        pygame.display.flip()
-        draw_elements(screen, game_map, players, turn, round_num)
-        missile_trajectories = [t for t in missile_trajectories if t]
 
-    pygame.display.flip()
+'''
+This function reads from the model and updates the view.
+Draws a frame of the round: the terrain and tanks, then the shells and
+explosions of a shot playing out.
+@param alpha is how far (0 to 1) the clock is from the last simulation tick
+to the next one, shells are drawn that far along from their previous
+position to their current one
+@param aim is the air strike preview from aim_preview while the player aims one
+@param view_x is the battlefield column at the left edge of the screen, only
+what is in view is drawn
+'''
+def draw_frame(screen, engine, shells, explosions, alpha, round_num, renderer, aim=None, view_x=0):
+    players, turn = engine.players, engine.turn
+    draw_elements(screen, engine.game_map, players, turn, round_num, renderer, view_x)
+    left, right = view_x - CULL_MARGIN, view_x + screen.get_width() + CULL_MARGIN
+    radius = players[turn].get_shell_radius()
+    # Shells blink, a red core showing on every other row
+    shell = assets.disc(GRAY, radius)
+    lit_shell = assets.disc(GRAY, radius, (RED, max(radius - 3, 0)))
+    for (x0, y0), (x1, y1) in shells.values():
+        x, y = round(x0 + (x1 - x0)*alpha), round(y0 + (y1 - y0)*alpha)
+        if left <= x <= right:
+            renderer.add(screen.blit(lit_shell if y1 % 2 == 0 else shell, (x - view_x - radius, y - radius)))
+    for (x, y), frames, index in explosions:
+        if left <= x <= right:
+            sprite, blast_radius = frames[index]
+            renderer.add(screen.blit(sprite, (x - view_x - blast_radius, y - blast_radius)))
+    if aim is not None:
+        pointer, (x, y), blast_radius = aim
+        landing = (x - view_x, y)
+        renderer.add(pygame.draw.line(screen, RED, (landing[0], 0), landing))
+        renderer.add(pygame.draw.circle(screen, RED, landing, blast_radius, 1))
+        renderer.add(pygame.draw.circle(screen, RED, (pointer[0] - view_x, pointer[1]), CURSOR_RADIUS, 1))
+    profiler.present(renderer)
 
 
-def draw_elements(screen, game_map, players, turn, round_num):
-    game_map.draw()
-    for index, player in enumerate(players):
+'''
+Draw the terrain and tanks in view from view_x (the battlefield column at the
+left edge of the screen), the stats of the player whose turn it is and the
+scoreboard. Only the tanks the map's grid has near the view are looked at, so
+the cost does not grow with the width of the battlefield.
+'''
+def draw_elements(screen, game_map, players, turn, round_num, renderer=None, view_x=0):
+    renderer = renderer or Renderer(screen)
+    renderer.restore(game_map.get_surface(view_x))
+    current = players[turn]
+    if not current.destroyed and not current.exploding:
+        renderer.add(current.draw_stats())
+    half = screen.get_width()/2
+    for player in game_map.tanks.near(view_x + half, half + CULL_MARGIN):
         if not player.destroyed:
             if player.exploding:
-                if not player.draw_death():
-                    player.destroyed = True
+                renderer.add(player.draw_death(view_x))
             else:
-                if turn == index:
-                    player.draw(True)
-                else:
-                    player.draw(False)
-    ranked = sorted(players, key=lambda p: p.round_score, reverse=True)
-    round_font = pygame.font.SysFont('Calibri', 25, True, True)
-    round_font.set_underline(True)
-    screen.blit(round_font.render('Round: '+str(round_num), True, BLACK),(3 * WIDTH / 4, (HEIGHT / 6)))
+                for rect in player.draw(False, view_x):
+                    renderer.add(rect)
+    ranked = sorted(players, key=lambda p: p.round_score, reverse=True)[:SCOREBOARD_SIZE]
+    renderer.add(screen.blit(assets.text(('Calibri', 25, True, True, True), 'Round: '+str(round_num), BLACK),(3 * WIDTH / 4, (HEIGHT / 6))))
     for index, player in enumerate(ranked):
-        screen.blit(pygame.font.SysFont('Calibri', 20, True, True).render(player.name+' : '+str(player.round_score), True, player.color),
-                    (3*WIDTH/4, (HEIGHT/6 + 10) + (index+1)*20))
-
-
+        renderer.add(screen.blit(assets.text(('Calibri', 20, True, True), player.name+' : '+str(player.round_score), player.color),
+                    (3*WIDTH/4, (HEIGHT/6 + 10) + (index+1)*20)))
 
-'''
-This function iterates through the players after a missile is fired and updates
-the model (health, live status, score) accordingly
-'''
-
-def calculate_and_apply_damage(players, turn, game_map, position, max_radius):
-    damage = players[turn].get_weapon_damage()
-    game_map.apply_damage(position ,max_radius)
-    for player in players:
-        if player.in_blast_radius(position, max_radius):
-            player.apply_damage(damage)
-            players[turn].add_score(player)
 
 
 '''
@@ -114,11 +160,16 @@ This function handles the view and model for the weapon store interface
 allowing players to buy weapons, and decrementing their score accordingly
 '''
 
-def open_store(screen, clock, players):
+def open_store(screen, clock, players, recorder=None, playback=None):
+    # A replay buys what was bought when it was recorded, without the screen
+    if playback is not None:
+        for index, item in playback.next_store() or []:
+            buy(players[index], item)
+        return
     try:
         tankImg = pygame.image.load('Tanks/images/tank_weapon.jpg')
         tankImg = pygame.transform.scale(tankImg, (WIDTH, HEIGHT))
-    except pygame.error as message:
+    except (pygame.error, OSError):
         tankImg = pygame.Surface(SCREEN_DIMS)
         tankImg.fill(GREEN)
     item_box = pygame.Surface((4 * WIDTH / 5, 4 * HEIGHT / 5))
@@ -132,8 +183,16 @@ def open_store(screen, clock, players):
 
 
 
+    profile.start('store')
+    purchases = []
     # Load game or new game
-    for player in players:
+    for index, player in enumerate(players):
+        # Computer players do their own shopping
+        if player.controller is not None:
+            item = player.controller.shop(player)
+            if item is not None:
+                purchases.append((index, item))
+            continue
         #  A button will be a rectangle, a tiny square and a weapon name
         buttons = []
         store_items = list(weapon.weapons.keys()) + list(weapon.upgrades.keys())
@@ -148,10 +207,11 @@ def open_store(screen, clock, players):
         done = False
         while not done:
             clock.tick(FPS)
+            profile.frame()
             screen.fill(GREEN)
             screen.blit(tankImg, (0,0))
             screen.blit(item_box, (WIDTH / 10, HEIGHT / 10))
-            screen.blit(pygame.font.SysFont('Arial', 20, True).render(player.name + ' : You have $' + str(player.total_score), True, GOLD),
+            screen.blit(assets.text(('Arial', 20, True), player.name + ' : You have $' + str(player.total_score), GOLD),
                         (WIDTH / 4 + 30 , HEIGHT/10 + 20))
             for i,button in enumerate(buttons):
                 # How much does the player have alreay
@@ -170,14 +230,15 @@ def open_store(screen, clock, players):
 
                 screen.blit(button[0],(option_x + int((i/9))*(option_w + (option_h + 5) + 20), option_y + (i%9)*(option_h + 5)))
 
-                screen.blit(pygame.font.SysFont('Arial', 13, True).render(button[2] + ' : : ' + gain + ' for $' + cost, True, BLACK),
+                screen.blit(assets.text(('Arial', 13, True), button[2] + ' : : ' + gain + ' for $' + cost, BLACK),
                             (option_x + int((i / 9)) * (option_w + (option_h + 5) + 20) + 10, option_y + (i % 9) * (option_h + 5) + 10))
 
                 screen.blit(button[1],(option_x + int((i/9))*(option_w + (option_h + 5) + 20) +  (option_w +5), option_y+(i%9)*(option_h + 5)))
 
-                screen.blit(pygame.font.SysFont('Arial', 13, True).render(quantity, True, BLACK),
+                screen.blit(assets.text(('Arial', 13, True), quantity, BLACK),
                             (option_x + int((i / 9)) * (option_w + (option_h + 5) + 20) + (option_w +5) + 5,
                              option_y + (i % 9) * (option_h + 5) + 10))
+            profile.mark('draw')
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -185,15 +246,32 @@ def open_store(screen, clock, players):
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     x,y = pygame.mouse.get_pos()
                     choice = get_selection(buttons, x, y,option_x, option_y, option_w, option_h)
-                    if choice in weapon.weapons:
-                        player.add_weapon(choice)
-                    elif choice in weapon.upgrades:
-                        player.upgrade(choice)
+                    if choice in weapon.weapons or choice in weapon.upgrades:
+                        buy(player, choice)
+                        purchases.append((index, choice))
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
                         done = True
                         break
+                    elif event.key == pygame.K_F3:
+                        profile.toggle()
+            profile.mark('events')
+            profile.draw(screen)
             pygame.display.flip()
+            profile.mark('present')
+    profile.save()
+    if recorder is not None:
+        recorder.store(purchases)
+
+
+'''
+Buy a weapon or an upgrade for a player, if the player can afford it
+'''
+def buy(player, item):
+    if item in weapon.weapons:
+        player.add_weapon(item)
+    elif item in weapon.upgrades:
+        player.upgrade(item)
 
 '''
 A helper function the store uses to get the button name that the user has clicked 
@@ -213,7 +291,7 @@ def opening_sequence(screen, clock):
     try:
         tankImg = pygame.image.load('Tanks/images/tank_main.jpg')
         tankImg = pygame.transform.rotozoom(tankImg, 0, WIDTH / 700)
-    except pygame.error as message:
+    except (pygame.error, OSError):
         tankImg = pygame.Surface(SCREEN_DIMS)
         tankImg.fill(GREEN)
     i = 0
@@ -222,7 +300,7 @@ def opening_sequence(screen, clock):
         clock.tick(FPS)
         screen.fill(GREEN)
         screen.blit(tankImg, (int(WIDTH/70),int(HEIGHT/30)))
-        screen.blit(pygame.font.SysFont('Calibri', int(WIDTH/10), True, True).render('BATTLE TANKS', True, RED if (i/40)%2==0 else YELLOW), (int(WIDTH/15), min(i, int(7*HEIGHT/10))))
+        screen.blit(assets.text(('Calibri', int(WIDTH/10), True, True), 'BATTLE TANKS', RED if (i/40)%2==0 else YELLOW), (int(WIDTH/15), min(i, int(7*HEIGHT/10))))
         for e in pygame.event.get():
             if e.type == pygame.QUIT:
                 sys.exit(0)
@@ -233,78 +311,100 @@ def opening_sequence(screen, clock):
 
 
 '''
-Show a list of load files, and load the one that gets clicked on.
+Show the saved games a page at a time, newest first, and load the one that
+gets clicked on. Typing filters the list by file, map or player name, the
+arrow keys page through it and escape goes back to the main menu.
+@return (players, game_map, round number), or None to go back
 '''
 def load_game(screen, clock, item_box, tankImg):
-
-    save_file_names = os.listdir('Tanks/saved_games')
-    if not save_file_names:
-        return
-    r_h = min(30,int((2*HEIGHT/3)/len(save_file_names)))
-    r_w = (2*WIDTH/3) - (WIDTH/10)
-    r_x = (WIDTH/6) + (WIDTH/20)
-    r_y_start = HEIGHT/5 + 30
-    rectangles = []
-    for i in range(len(save_file_names)):
-        rectangles.append(pygame.Rect([r_x, r_y_start + i * (r_h+5), r_w, r_h]))
-    done = False
-
-    # Let the user choose the load file
-    while not done:
+    index = SaveIndex(SAVE_DIR, SCREEN_DIMS, SIM_HZ)
+    index.refresh()
+    typed = ''
+    page = 0
+    r_h = 45
+    r_w = (2*WIDTH/3) - 20
+    r_x = (WIDTH/6) + 10
+    r_y_start = HEIGHT/6 + 70
+    rectangles = [pygame.Rect([r_x, r_y_start + i * r_h, r_w, r_h - 5]) for i in range(SAVES_PER_PAGE)]
+    thumbnail_dims = (int(r_h*4/3), r_h - 9)
+    load_file = None
+    # Why the last save chosen could not be loaded
+    error = None
+
+    # Let the user choose the load file, until one loads
+    while True:
         clock.tick(FPS)
+        saves = index.find(typed)
+        pages = max((len(saves) + SAVES_PER_PAGE - 1) // SAVES_PER_PAGE, 1)
+        page = min(page, pages - 1)
+        shown = saves[page*SAVES_PER_PAGE:(page+1)*SAVES_PER_PAGE]
+
         screen.fill(GREEN)
         screen.blit(tankImg, (WIDTH / 6, HEIGHT / 10))
         screen.blit(item_box, (WIDTH / 6, HEIGHT / 6))
-        screen.blit(pygame.font.SysFont('Arial', 25, True).render('Choose Save File', True, BLACK), (WIDTH/4 + 60, HEIGHT/6 + 10))
-        for i in range(len(save_file_names)):
-            pygame.draw.rect(screen, GRAY, rectangles[i])
-            screen.blit(pygame.font.SysFont('Arial',20, True).render(save_file_names[i], True, WHITE),
-                        (r_x + 10, r_y_start + i*(r_h+5)+3))
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return [], None
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    x, y = pygame.mouse.get_pos()
-                    choices = [r.collidepoint(x,y) for r in rectangles]
-                    if True in choices:
-                        load_file = save_file_names[choices.index(True)]
-                        done = True
-                        break
-        pygame.display.flip()
-
-    players = []
-    # Read the load file and initialize players and map
-    with open('Tanks/saved_games/'+load_file) as f:
-
-        # First read the map
-        type = f.readline()[:-1]
-        game_map = Map(screen, type, SCREEN_DIMS)
-        terrain = list(map(float, (f.readline()[1:-2]).split(', ')))
-        game_map.set_terrain(terrain)
+        screen.blit(assets.text(('Arial', 25, True), 'Choose Save File', BLACK), (WIDTH/4 + 60, HEIGHT/6 + 10))
+        screen.blit(assets.text(('Arial', 15, True), 'Filter: ' + typed + '_', BLACK), (r_x, HEIGHT/6 + 45))
+        if not shown:
+            screen.blit(assets.text(('Arial', 20, True), 'No saved games' + (' match' if typed else ''), GRAY), (r_x + 10, r_y_start))
+        for rect, (name, entry) in zip(rectangles, shown):
+            pygame.draw.rect(screen, GRAY, rect)
+            screen.blit(assets.thumbnail((name, entry['mtime']), entry['thumbnail'], entry['color'], HEIGHT, thumbnail_dims),
+                        (rect.x + 4, rect.y + 2))
+            saved = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['mtime']))
+            screen.blit(assets.text(('Arial', 16, True), os.path.splitext(name)[0], WHITE), (rect.x + thumbnail_dims[0] + 12, rect.y + 2))
+            screen.blit(assets.text(('Arial', 12), saved, WHITE), (rect.right - 100, rect.y + 4))
+            scores = ', '.join(player[0] + ' ' + str(player[2]) for player in entry['players'])
+            summary = entry['type'] + ' - round ' + str(entry['round']) + ' - ' + scores
+            if len(summary) > SUMMARY_LENGTH:
+                summary = summary[:SUMMARY_LENGTH - 3] + '...'
+            screen.blit(assets.text(('Arial', 12), summary, WHITE), (rect.x + thumbnail_dims[0] + 12, rect.y + 21))
+        screen.blit(assets.text(('Arial', 15, True), 'Page ' + str(page + 1) + ' / ' + str(pages) + '  (arrows to turn, esc to go back)', BLACK),
+                    (r_x, r_y_start + SAVES_PER_PAGE*r_h))
+        if error is not None:
+            screen.blit(assets.text(('Arial', 12, True), error, RED), (r_x, r_y_start + SAVES_PER_PAGE*r_h + 20))
 
-        # Read the number of players
-        num_players = int(f.readline()[:-1])
-        for i in range(num_players):
-            #Read the name, color and center
-            name = f.readline()[:-1]
-            color = tuple(json.loads(f.readline()[:-1]))
-            init_x, init_y = tuple(json.loads(f.readline()[:-1]))
-
-            #Create the player
-            player = Player(screen, game_map, name, color,init_x, init_y, SCREEN_DIMS, FPS)
-
-            #Load the player stats
-            player.load(f)
-            players.append(player)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return [], None, 1
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                x, y = pygame.mouse.get_pos()
+                for rect, (name, _) in zip(rectangles, shown):
+                    if rect.collidepoint(x, y):
+                        load_file = name
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    return None
+                elif event.key in (pygame.K_RIGHT, pygame.K_DOWN, pygame.K_PAGEDOWN):
+                    page = min(page + 1, pages - 1)
+                elif event.key in (pygame.K_LEFT, pygame.K_UP, pygame.K_PAGEUP):
+                    page = max(page - 1, 0)
+                elif event.key == pygame.K_RETURN:
+                    if shown:
+                        load_file = shown[0][0]
+                elif event.key == pygame.K_BACKSPACE:
+                    typed = typed[:-1]
+                    page = 0
+                elif event.unicode and event.unicode.isprintable():
+                    typed += event.unicode
+                    page = 0
+        pygame.display.flip()
 
-    return players, game_map
+        if load_file is not None:
+            # Read the load file and initialize players and map. The file may
+            # have changed since it was indexed
+            try:
+                return savefile.load_any(os.path.join(SAVE_DIR, load_file), screen, SCREEN_DIMS, SIM_HZ)
+            except (OSError, ValueError) as e:
+                error = 'Could not load {}: {}'.format(load_file, e)[:2*SUMMARY_LENGTH]
+                load_file = None
+                index.refresh()
 
 
 '''
 Allows the player to save the current game state to a file
 '''
 
-def save_game(screen, clock, game_map, players):
+def save_game(screen, clock, game_map, players, round_num=1):
 
     name = ''
     done = False
@@ -312,7 +412,7 @@ def save_game(screen, clock, game_map, players):
         clock.tick(FPS)
         pygame.draw.rect(screen, BLACK, [WIDTH/3 - 2, (HEIGHT / 6) + 78, WIDTH / 3 + 4, 44])
         pygame.draw.rect(screen, GRAY, [WIDTH/3, (HEIGHT / 6) + 80, WIDTH / 3, 40])
-        screen.blit(pygame.font.SysFont('Calibri', 20, True).render(name, True, WHITE),
+        screen.blit(assets.text(('Calibri', 20, True), name, WHITE),
                     (WIDTH/3 + 10, HEIGHT / 6 + 85))
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -329,11 +429,8 @@ def save_game(screen, clock, game_map, players):
                     name += event.unicode
         pygame.display.flip()
 
-    with open('Tanks/saved_games/'+name+'.txt', 'w+') as f:
-        game_map.dump(f)
-        f.write(str(len(players))+'\n')
-        for player in players:
-            player.dump(f)
+    # Written in the background, the game goes on right away
+    autosave.writer.submit(os.path.join(SAVE_DIR, name+savefile.EXTENSION), savefile.snapshot(game_map, players, round_num))
 
 
 '''
@@ -346,7 +443,7 @@ def main_menu_sequence(screen, clock):
     try:
         tankImg = pygame.image.load('Tanks/images/tank_menu.jpg')
         tankImg = pygame.transform.rotozoom(tankImg, 0, WIDTH / 600)
-    except pygame.error as message:
+    except (pygame.error, OSError):
         tankImg = pygame.Surface(SCREEN_DIMS)
         tankImg.fill(GREEN)
     item_box = pygame.Surface((2*WIDTH/3, 2*HEIGHT/3))
@@ -364,19 +461,21 @@ def main_menu_sequence(screen, clock):
         new_button= pygame.Rect([(WIDTH / 4) + 50, (HEIGHT / 6) + 80, WIDTH / 3, 60])
         load_button = pygame.Rect([(WIDTH / 4) + 50, (HEIGHT / 6) + 200, WIDTH / 3, 60])
         pygame.draw.rect(screen, GRAY, new_button)
-        screen.blit(pygame.font.SysFont('Arial', 25, True).render('New Game', True, WHITE), ((WIDTH/4) + 100, HEIGHT/6 + 97))
+        screen.blit(assets.text(('Arial', 25, True), 'New Game', WHITE), ((WIDTH/4) + 100, HEIGHT/6 + 97))
         pygame.draw.rect(screen, GRAY, load_button)
-        screen.blit(pygame.font.SysFont('Arial', 25, True).render('Load Game', True, WHITE), ((WIDTH/4) + 100, HEIGHT/6 + 217))
+        screen.blit(assets.text(('Arial', 25, True), 'Load Game', WHITE), ((WIDTH/4) + 100, HEIGHT/6 + 217))
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                return [], None
+                return [], None, 1
             if event.type == pygame.MOUSEBUTTONDOWN:
                 x,y = pygame.mouse.get_pos()
                 if new_button.collidepoint(x,y):
                     done = True
                     break
                 elif load_button.collidepoint(x,y):
-                    return load_game(screen, clock, item_box, tankImg)
+                    loaded = load_game(screen, clock, item_box, tankImg)
+                    if loaded is not None:
+                        return loaded
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RETURN:
                     done = True
@@ -384,8 +483,9 @@ def main_menu_sequence(screen, clock):
         pygame.display.flip()
 
 
-    #Set default number of players to 2
+    #Set default number of players to 2, several digits can be typed for larger battles
     num_players = 2
+    typed = ''
     done = False
 
     #Choose the number of players
@@ -394,17 +494,23 @@ def main_menu_sequence(screen, clock):
         screen.fill(GREEN)
         screen.blit(tankImg, (WIDTH/6,HEIGHT/10))
         screen.blit(item_box,(WIDTH/6, HEIGHT/6))
-        screen.blit(pygame.font.SysFont('Arial', 25, True).render('Enter the Number of Players', True, BLACK), (WIDTH/4, HEIGHT/6 + 30))
-        screen.blit(pygame.font.SysFont('Arial', 100, True).render(str(num_players), True, BLACK), (WIDTH/2 - 30, HEIGHT/3 + 30))
+        screen.blit(assets.text(('Arial', 25, True), 'Enter the Number of Players', BLACK), (WIDTH/4, HEIGHT/6 + 30))
+        screen.blit(assets.text(('Arial', 100, True), str(num_players), BLACK), (WIDTH/2 - 30, HEIGHT/3 + 30))
+        if num_players > NAMED_PLAYERS:
+            screen.blit(assets.text(('Arial', 15, True), 'Large battle: players past ' + str(NAMED_PLAYERS) + ' are computer controlled', BLACK),
+                        (WIDTH/4, HEIGHT/3 + 150))
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                return [], None
+                return [], None, 1
             if event.type == pygame.KEYDOWN:
-                if pygame.key.name(event.key).isdigit():
-                    num_players = int(pygame.key.name(event.key))
+                if event.unicode.isdigit() and int(typed + event.unicode) <= MAX_PLAYERS:
+                    typed = str(int(typed + event.unicode))
+                elif event.key == pygame.K_BACKSPACE:
+                    typed = typed[:-1]
                 elif event.key == pygame.K_RETURN:
                     done = True
                     break
+                num_players = int(typed) if typed else 2
         pygame.display.flip()
 
     done = False
@@ -426,14 +532,14 @@ def main_menu_sequence(screen, clock):
         screen.fill(GREEN)
         screen.blit(tankImg, (WIDTH/6,HEIGHT/10))
         screen.blit(item_box,(WIDTH/6, HEIGHT/6))
-        screen.blit(pygame.font.SysFont('Calibri', 25, True).render('Choose Terrain Type', True, BLACK),(WIDTH/4, HEIGHT/6 + 30))
+        screen.blit(assets.text(('Calibri', 25, True), 'Choose Terrain Type', BLACK),(WIDTH/4, HEIGHT/6 + 30))
         for i, option in enumerate(options):
             pygame.draw.circle(screen, WHITE, (radio_start_x , radio_start_y + vertical_spacing*i), 10)
-            screen.blit(pygame.font.SysFont('Calibri', 20, True).render(option, True, BLACK),(text_start_x, text_start_y + vertical_spacing*i))
+            screen.blit(assets.text(('Calibri', 20, True), option, BLACK),(text_start_x, text_start_y + vertical_spacing*i))
         pygame.draw.circle(screen, BLACK, (radio_start_x , radio_start_y + vertical_spacing*chosen_pos), 7)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                return [], None
+                return [], None, 1
             if event.type == pygame.MOUSEBUTTONDOWN:
                  chosen_pos = get_choice(radio_centers, chosen_pos, pygame.mouse.get_pos())
             if event.type == pygame.KEYDOWN:
@@ -455,25 +561,31 @@ def main_menu_sequence(screen, clock):
     horizontal_spacing = 40
     color_centers = [(color_start_x + horizontal_spacing*i, color_start_y) for i in range(len(colors))]
 
+    # Who controls the tank, a person or the computer at some difficulty
+    controllers = ['Human'] + list(ai.DIFFICULTIES)
+    controller_spacing = 90
+    controller_centers = [(color_start_x + controller_spacing*i, color_start_y + 50) for i in range(len(controllers))]
 
-    for i in range(1,num_players+1):
+
+    for i in range(1,min(num_players, NAMED_PLAYERS)+1):
         done = False
         # Set default color to 0 and name to empty
         name = 'Player '+str(i)
         chosen_color = 0
+        chosen_controller = 0
         while not done:
             clock.tick(FPS)
             screen.fill(GREEN)
             screen.blit(tankImg, (WIDTH / 6, HEIGHT / 10))
             screen.blit(item_box, (WIDTH / 6, HEIGHT / 6))
-            screen.blit(pygame.font.SysFont('Calibri', 25, True).render('Enter Player '+str(i)+"'s Name: ", True, BLACK),
+            screen.blit(assets.text(('Calibri', 25, True), 'Enter Player '+str(i)+"'s Name: ", BLACK),
                         (WIDTH / 4, HEIGHT / 6 + 30))
-            screen.blit(pygame.font.SysFont('Calibri', 25, True).render('Choose Player '+str(i)+"'s Color: ", True, BLACK),
+            screen.blit(assets.text(('Calibri', 25, True), 'Choose Player '+str(i)+"'s Color: ", BLACK),
                         (WIDTH / 4, 2*HEIGHT / 6 + 60))
 
             pygame.draw.rect(screen, WHITE, [(WIDTH / 4), (HEIGHT / 6)  + 80, WIDTH/3 , 40])
 
-            screen.blit(pygame.font.SysFont('Calibri', 20, True).render(name, True, colors[chosen_color]),
+            screen.blit(assets.text(('Calibri', 20, True), name, colors[chosen_color]),
                         (WIDTH / 4 + 10, HEIGHT / 6 + 85))
 
             for j, color in enumerate(colors):
@@ -482,16 +594,23 @@ def main_menu_sequence(screen, clock):
             #Fill in chosen option
             pygame.draw.circle(screen, GRAY, color_centers[chosen_color], 7)
 
+            for j, controller in enumerate(controllers):
+                pygame.draw.circle(screen, WHITE, controller_centers[j], 10)
+                screen.blit(assets.text(('Calibri', 20, True), controller, BLACK),
+                            (controller_centers[j][0] + 15, controller_centers[j][1] - 10))
+            pygame.draw.circle(screen, BLACK, controller_centers[chosen_controller], 7)
+
             #Register the events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    return [], None
+                    return [], None, 1
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     chosen_color = get_choice(color_centers, chosen_color, pygame.mouse.get_pos())
+                    chosen_controller = get_choice(controller_centers, chosen_controller, pygame.mouse.get_pos())
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
                         done = True
-                        names_and_colors.append((name, colors[chosen_color]))
+                        names_and_colors.append((name, colors[chosen_color], controllers[chosen_controller]))
                         break
                     elif event.key == pygame.K_BACKSPACE:
                         name = name[:-1]
@@ -500,13 +619,18 @@ def main_menu_sequence(screen, clock):
 
             pygame.display.flip()
 
-    game_map = Map(screen, chosen_map, SCREEN_DIMS)
-    terrain = game_map.get_terrain()
+    for i in range(len(names_and_colors) + 1, num_players + 1):
+        names_and_colors.append(('Player '+str(i), colors[(i - 1) % len(colors)], LARGE_BATTLE_DIFFICULTY))
+
+    game_map = Map(screen, chosen_map, SCREEN_DIMS, width=world_width(num_players, WIDTH))
     players = [Player(screen, game_map, names_and_colors[i][0], names_and_colors[i][1],
-                      (i+1)*WIDTH/(num_players+1) , terrain[int((i+1)*WIDTH/(num_players+1))], SCREEN_DIMS, FPS)
+                      (i+1)*game_map.width/(num_players+1) , game_map.height(int((i+1)*game_map.width/(num_players+1))), SCREEN_DIMS, SIM_HZ)
                for i in range(num_players)]
+    for player, (_, _, controller) in zip(players, names_and_colors):
+        if controller in ai.DIFFICULTIES:
+            player.controller = ai.Computer(controller)
 
-    return players, game_map
+    return players, game_map, 1
 
 
 '''
@@ -521,36 +645,64 @@ def get_choice(centers, curr_pos, new_pos):
     return curr_pos
 
 
-'''
-This function is used to check whether a given round has ended
-(When 1 or fewer players are left standing)
-'''
-
-def game_ended(players):
-    return sum([0 if (p.destroyed or p.exploding) else 1 for p in players ])<=1
-
-
-
 '''
 This loop handles everything related to input events like mouse clicks
 and key presses and updates the model
 '''
 
-def game_sequence(screen, clock, game_map, players, round_number):
-    num_players = len(players)
-    turn = 0
+def game_sequence(screen, clock, game_map, players, round_number, renderer=None, autosaver=None, recorder=None, playback=None):
+    renderer = renderer or Renderer(screen)
+    # Whatever screen came before (menus, store) has to be painted over fully
+    renderer.invalidate()
+    engine = Engine(game_map, players)
+    profile.start('round-' + str(round_number))
     rotation = 0
     right = False
     left = False
     power_up = False
     power_down = False
-    firing = False
-    while not game_ended(players):
-        clock.tick(FPS)
-        missile_trajectories = []
+    # Key presses wait here for the next simulation tick
+    fire = False
+    switch = 0
+    recharge = False
+    # While aiming an air strike the player points at its target with the
+    # mouse, aim being the preview drawn at the pointer (None to work it out again)
+    aiming = False
+    pointer = None
+    aim = None
+    target = None
+    # True while a shot plays out, its shells in the air as {flight: (previous, current position)}
+    shot = False
+    shells = {}
+    explosions = []
+    # Time the simulation is behind the clock
+    lag = 0
+    # Where the screen looks on the battlefield, redrawn in full when it moves
+    camera = Camera(screen.get_width(), game_map.width, engine.current_player().rect.centerx)
+    view_x = camera.x
+    while True:
+        lag = min(lag + clock.tick(FPS)/1000, MAX_LAG)
+        profile.frame()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                profile.save()
                 return False
+            elif event.type == pygame.VIDEOEXPOSE:
+                renderer.invalidate()
+            elif event.type == pygame.MOUSEMOTION and aiming:
+                pointer = event.pos
+                aim = None
+            elif event.type == pygame.MOUSEBUTTONDOWN and aiming:
+                if event.button == 1:
+                    # Fires on the next tick, the point goes into the Action so replays need no mouse
+                    target = camera.to_world(event.pos)
+                    fire = True
+                aiming = False
+            elif event.type == pygame.KEYDOWN and aiming:
+                if event.key == pygame.K_ESCAPE:
+                    aiming = False
+                elif event.key == pygame.K_F3:
+                    profiler.toggle(renderer)
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RIGHT:
                     right = True
@@ -563,12 +715,7 @@ def game_sequence(screen, clock, game_map, players, round_number):
                 elif event.key == pygame.K_DOWN:
                     rotation = -1
                 elif event.key == pygame.K_SPACE:
-                    missile_trajectories = [list(reversed(t)) for t in players[turn].get_shot_trajectory()]
-                    if not missile_trajectories:
-                        continue
-                    firing = True
-                    right = False
-                    left = False
+                    fire = True
                 elif event.key == pygame.K_x:
                     power_up = True
                     power_down = False
@@ -576,13 +723,16 @@ def game_sequence(screen, clock, game_map, players, round_number):
                     power_up = False
                     power_down = True
                 elif event.key == pygame.K_s:
-                    players[turn].switch_weapon(1)
+                    switch += 1
                 elif event.key == pygame.K_a:
-                    players[turn].switch_weapon(-1)
+                    switch -= 1
                 elif event.key == pygame.K_ESCAPE:
-                    save_game(screen, clock,game_map, players)
+                    save_game(screen, clock,game_map, players, round_number)
+                    renderer.invalidate()
                 elif event.key == pygame.K_r:
-                    players[turn].health_recharge()
+                    recharge = True
+                elif event.key == pygame.K_F3:
+                    profiler.toggle(renderer)
             elif event.type == pygame.KEYUP:
                 if event.key == pygame.K_RIGHT:
                     right = False
@@ -594,19 +744,98 @@ def game_sequence(screen, clock, game_map, players, round_number):
                     power_up = False
                 if event.key == pygame.K_z:
                     power_down = False
-        update_view(screen, clock, players, turn, game_map, missile_trajectories, round_number)
-        players[turn].move(left, right, rotation, power_up, power_down)
-        if firing:
-            firing = False
-            while True:
-                turn = (turn + 1) % num_players
-                if not players[turn].exploding:
-                    break
-                if game_ended(players):
+        profile.mark('events')
+
+        # Run as many simulation ticks as the time since the last frame holds
+        while lag >= TICK:
+            lag -= TICK
+            if shot:
+                shells = step_shot(engine, shells, explosions, renderer, view_x)
+                if not engine.flights and not explosions:
+                    shot = False
+                    engine.settle()
+                    profile.mark('move')
+                    if autosaver is not None:
+                        autosaver.save(game_map, players, round_number)
+            else:
+                if engine.game_ended():
+                    profile.save()
                     return True
-    return True
+                controller = engine.current_player().controller
+                if playback is not None or controller is not None:
+                    # Keys pressed while the computer or the replay plays are not kept for the next person
+                    fire = False
+                    switch = 0
+                    recharge = False
+                if playback is not None:
+                    action = playback.next_action()
+                    if action is None:
+                        # The recording ends here
+                        profile.save()
+                        return False
+                elif controller is not None:
+                    action = controller.act(engine)
+                elif aiming:
+                    # The tank holds still while its player aims
+                    action = Action(0, 0, 0, 0, False, None, False)
+                else:
+                    if fire and target is None and aims_air_strike(engine.current_player(), switch):
+                        # Switch to the air strike now, it is fired once a target is clicked
+                        aiming = True
+                        pointer = pygame.mouse.get_pos()
+                        aim = None
+                        fire = False
+                    action = Action(right - left, rotation, power_up - power_down, switch, fire, target, recharge)
+                    fire = False
+                    switch = 0
+                    recharge = False
+                    target = None
+                if recorder is not None:
+                    recorder.action(action)
+                profile.mark('ai')
+                shot = engine.act(action)
+                profile.mark('move')
+                if shot:
+                    right = False
+                    left = False
+            for player in players:
+                if player.exploding and not player.destroyed:
+                    player.advance_death()
+
+        # Follow the shells of a shot, or the tank whose turn it is
+        if shells:
+            camera.follow(sum(x for _, (x, _) in shells.values())/len(shells))
+        elif aiming:
+            camera.pan(pointer)
+        elif not explosions:
+            camera.follow(engine.current_player().rect.centerx)
+        if camera.x != view_x:
+            view_x = camera.x
+            renderer.invalidate()
+            aim = None
+        if aiming and aim is None:
+            aim = aim_preview(engine.current_player(), camera.to_world(pointer))
+        draw_frame(screen, engine, shells, explosions, lag/TICK, round_number, renderer, aim if aiming else None, view_x)
+
 
 
+'''
+@return True iff firing after switching weapons by switch fires an air strike
+'''
+def aims_air_strike(player, switch):
+    names = list(player.weapons.keys())
+    name = names[(names.index(player.current_weapon) + switch) % len(names)]
+    return weapon.weapons[name]['get_path'] is weapon.airstrike_path and player.weapons[name] != 0
+
+
+'''
+Where an air strike aimed at point would land, for the targeting preview
+@return (point, landing point, blast radius)
+'''
+def aim_preview(player, point):
+    landing = weapon.airstrike_landing(point, player.fps, player.game_map.get_terrain(), player.game_map.tanks)
+    return point, landing, weapon.weapons[player.current_weapon]['explosion_radius']
+
 
 '''
 The main function is responsible for orchestrating the 
@@ -615,32 +844,101 @@ transitions between various sequences in the game
 
 def main():
     # Initialize pygame and create window
-    round_num = 1
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("Battle Tanks")
     clock = pygame.time.Clock()
+    renderer = DirtyRenderer(screen) if DIRTY_RECTS else Renderer(screen)
 
     #Run the opening sequence
     opening_sequence(screen, clock)
 
     #Generate the players and the game map based on user input
-    players, game_map = main_menu_sequence(screen, clock)
+    players, game_map, round_num = main_menu_sequence(screen, clock)
 
     if not players or not game_map:
         return
 
+    # Everything random from here on comes from one seed, so the match can be replayed
+    seed = random.randrange(2**32)
+    rng = random.Random(seed)
+    recorder = replay.Recorder(seed, game_map, players, round_num, SIM_HZ, SCREEN_DIMS)
+    seed_controllers(players, rng)
+
     #Start the game_sequence
-    while True:
-        if not game_sequence(screen, clock, game_map, players, round_num):
-            return
-        else:
-
-            open_store(screen, clock, players)
-        game_map = Map(screen, "Random", SCREEN_DIMS)
-        for player in players:
-            player.reset_player_stats(game_map)
-        random.shuffle(players)
+    autosaver = Autosaver(SAVE_DIR)
+    try:
+        while True:
+            if not game_sequence(screen, clock, game_map, players, round_num, renderer, autosaver, recorder):
+                return
+            else:
+
+                open_store(screen, clock, players, recorder)
+            round_num += 1
+            game_map = next_round(screen, players, rng)
+            autosaver.save(game_map, players, round_num)
+    finally:
+        # Saves still being written get to disk before the game exits
+        autosave.writer.close()
+        try:
+            recorder.save()
+        except OSError as e:
+            sys.stderr.write('Could not save the replay: {}\n'.format(e))
+
+
+'''
+Set up the next round: a new random map, every tank back to full health on
+it and a new order of turns
+@return the new map
+'''
+def next_round(screen, players, rng):
+    game_map = Map(screen, "Random", SCREEN_DIMS, rng, world_width(len(players), WIDTH))
+    for player in players:
+        player.reset_player_stats(game_map)
+    rng.shuffle(players)
+    return game_map
+
+
+'''
+Give each computer player its own random stream drawn from the match's
+'''
+def seed_controllers(players, rng):
+    for player in players:
+        if player.controller is not None:
+            player.controller.rng = random.Random(rng.randrange(2**32))
+
+
+'''
+Ticks a clock at the replay's speed, whatever rate the screens ask for
+'''
+class PlaybackClock:
+    def __init__(self, speed):
+        self.clock = pygame.time.Clock()
+        self.speed = speed
+
+    def tick(self, fps):
+        if not self.speed:
+            self.clock.tick()
+            return MAX_LAG*1000
+        return self.clock.tick(fps)*self.speed
+
+
+'''
+Play a replay back on screen
+@param speed multiplies the pace it was recorded at, 0 plays it as fast as possible
+'''
+def play_replay(playback, speed=1):
+    pygame.init()
+    screen = pygame.display.set_mode(playback.screen_dims)
+    pygame.display.set_caption("Battle Tanks - Replay")
+    clock = PlaybackClock(speed)
+    renderer = DirtyRenderer(screen) if DIRTY_RECTS else Renderer(screen)
+    players, game_map, round_num, rng = playback.begin(screen)
+    seed_controllers(players, rng)
+    while game_sequence(screen, clock, game_map, players, round_num, renderer, playback=playback) and not playback.finished():
+        open_store(screen, clock, players, playback=playback)
+        round_num += 1
+        game_map = next_round(screen, players, rng)
 
 if __name__ == '__main__':
     main()
@@ -1,17 +1,20 @@
 import pygame
+from Tanks import assets
 
 '''
 This is the class responsible for displaying all the game information on the screen for a given player
 
 '''
 
+# Font specs, the fonts themselves are shared through the assets registry
+NAME_FONT = ('Times New Roman', 16, True)
+HEALTH_FONT = ('Arial', 10, True)
+WEAPON_FONT = ('Times New Roman', 15, True)
+MONEY_FONT = ('Monaco', 20, True)
+
 class Gamestats:
     def __init__(self, screen, screen_dims):
         self.screen = screen
-        self.name_font = pygame.font.SysFont('Times New Roman', 16, True)
-        self.health_font = pygame.font.SysFont('Arial', 10, True)
-        self.weapon_font = pygame.font.SysFont('Times New Roman', 15, True)
-        self.money_font = pygame.font.SysFont('Monaco', 20, True)
         self.border_width = 2
         self.width = screen_dims[0]
         self.height = (screen_dims[1]/6)
@@ -21,17 +24,18 @@ class Gamestats:
         self.border_color = (100,100,100)
 
     def draw(self, player):
+        drawn = []
         #Draw the border
-        pygame.draw.rect(self.screen, self.border_color, [0,0,self.width,2]) #top
-        pygame.draw.rect(self.screen, self.border_color, [0,0,2, self.height]) #left
-        pygame.draw.rect(self.screen, self.border_color, [0,self.height - 2 ,self.width,2]) #bottom
-        pygame.draw.rect(self.screen, self.border_color, [self.width - 2,0,2, self.height]) #right
+        drawn.append(pygame.draw.rect(self.screen, self.border_color, [0,0,self.width,2])) #top
+        drawn.append(pygame.draw.rect(self.screen, self.border_color, [0,0,2, self.height])) #left
+        drawn.append(pygame.draw.rect(self.screen, self.border_color, [0,self.height - 2 ,self.width,2])) #bottom
+        drawn.append(pygame.draw.rect(self.screen, self.border_color, [self.width - 2,0,2, self.height])) #right
 
         # Draw the item_box
-        self.screen.blit(self.item_box, (2,2))
+        drawn.append(self.screen.blit(self.item_box, (2,2)))
 
         #Draw the player name
-        self.screen.blit(self.name_font.render(player.name, True, player.color),(5,5))
+        drawn.append(self.screen.blit(assets.text(NAME_FONT, player.name, player.color),(5,5)))
 
         #Draw the health/power_bar
         health_bar_height = int(0.8*self.height)
@@ -43,15 +47,15 @@ class Gamestats:
         health_bar_width = 30
 
         #Health bar
-        pygame.draw.rect(self.screen, (0,0,0), [health_bar_x ,health_bar_y ,health_bar_width, health_bar_height])
-        pygame.draw.rect(self.screen, (255,0,0), [health_bar_x ,health_bar_y + health_loss ,health_bar_width, health_bar_height - health_loss])
-        self.screen.blit(self.health_font.render(str(int(player.health)), True, (255,255,255)), (health_bar_x + (health_bar_width/5), health_bar_y + 2))
+        drawn.append(pygame.draw.rect(self.screen, (0,0,0), [health_bar_x ,health_bar_y ,health_bar_width, health_bar_height]))
+        drawn.append(pygame.draw.rect(self.screen, (255,0,0), [health_bar_x ,health_bar_y + health_loss ,health_bar_width, health_bar_height - health_loss]))
+        drawn.append(self.screen.blit(assets.text(HEALTH_FONT, str(int(player.health)), (255,255,255)), (health_bar_x + (health_bar_width/5), health_bar_y + 2)))
 
 
         #power bar
         power_height = (100 - player.power) * pixels_per_health
-        pygame.draw.rect(self.screen, (0,0,0), [health_bar_x-4, health_bar_y + power_height, health_bar_width+8, 2])
-        self.screen.blit(self.health_font.render(str(int(player.power)), True, (0,0,0)), (health_bar_x + health_bar_width + 5, health_bar_y + power_height))
+        drawn.append(pygame.draw.rect(self.screen, (0,0,0), [health_bar_x-4, health_bar_y + power_height, health_bar_width+8, 2]))
+        drawn.append(self.screen.blit(assets.text(HEALTH_FONT, str(int(player.power)), (0,0,0)), (health_bar_x + health_bar_width + 5, health_bar_y + power_height)))
 
         #Draw the fuel tank
         fuel_bar_x = self.width/30
@@ -59,9 +63,9 @@ class Gamestats:
         fuel_bar_width = 0.1 * self.width
         fuel_bar_height = 10
 
-        pygame.draw.rect(self.screen, (0,0,0), [fuel_bar_x, fuel_bar_y, fuel_bar_width, 10])
-        pygame.draw.rect(self.screen, (0,255,100), [fuel_bar_x, fuel_bar_y, int(fuel_bar_width*(player.fuel/player.max_fuel)), 10])
-        self.screen.blit(self.health_font.render(str(int(player.fuel)), True, (0,0,0)), (fuel_bar_x + fuel_bar_width +2,fuel_bar_y+(fuel_bar_height/2)))
+        drawn.append(pygame.draw.rect(self.screen, (0,0,0), [fuel_bar_x, fuel_bar_y, fuel_bar_width, 10]))
+        drawn.append(pygame.draw.rect(self.screen, (0,255,100), [fuel_bar_x, fuel_bar_y, int(fuel_bar_width*(player.fuel/player.max_fuel)), 10]))
+        drawn.append(self.screen.blit(assets.text(HEALTH_FONT, str(int(player.fuel)), (0,0,0)), (fuel_bar_x + fuel_bar_width +2,fuel_bar_y+(fuel_bar_height/2))))
 
         # Display the current weapon
         weapon = player.current_weapon
@@ -69,14 +73,15 @@ class Gamestats:
         count = str(count) if count >=0 else '∞'
         weapon_x = health_bar_x + health_bar_width + 25
         weapon_y = 5
-        self.screen.blit(self.weapon_font.render("Current Weapon: ", True, (0,0,0)), (weapon_x, weapon_y))
-        self.screen.blit(self.weapon_font.render("Current Ammo: ", True, (0,0,0)), (weapon_x, weapon_y + 17))
-        self.screen.blit(self.weapon_font.render(weapon, True, (255,0,0)), (weapon_x + 130, weapon_y))
-        self.screen.blit(self.weapon_font.render(': '+count, True, (255,0,0)), (weapon_x + 120, weapon_y + 17))
+        drawn.append(self.screen.blit(assets.text(WEAPON_FONT, "Current Weapon: ", (0,0,0)), (weapon_x, weapon_y)))
+        drawn.append(self.screen.blit(assets.text(WEAPON_FONT, "Current Ammo: ", (0,0,0)), (weapon_x, weapon_y + 17)))
+        drawn.append(self.screen.blit(assets.text(WEAPON_FONT, weapon, (255,0,0)), (weapon_x + 130, weapon_y)))
+        drawn.append(self.screen.blit(assets.text(WEAPON_FONT, ': '+count, (255,0,0)), (weapon_x + 120, weapon_y + 17)))
 
         # Display total score
 
-        self.screen.blit(self.money_font.render('$'+str(player.total_score), True, (255,150,0)), (weapon_x + 30, weapon_y + self.height/2))
+        drawn.append(self.screen.blit(assets.text(MONEY_FONT, '$'+str(player.total_score), (255,150,0)), (weapon_x + 30, weapon_y + self.height/2)))
+        return drawn[0].unionall(drawn[1:])
 
     def set_last_save(self, time):
         pass
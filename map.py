@@ -1,11 +1,26 @@
 import pygame
-import math
 import random
-from Tanks import utils
+import numpy as np
+from Tanks import assets, spatial
+
+# The rendered terrain is kept in strips this many columns wide, rendered as
+# they come into view. Only the CHUNKS_KEPT strips seen last are kept, so a
+# battlefield many screens wide costs no more to draw than one screen.
+CHUNK_WIDTH = 256
+CHUNKS_KEPT = 16
+
+# Battles of more than NAMED_PLAYERS tanks are large battles, fought on a
+# battlefield WIDTH_PER_TANK pixels a tank wide, which the screen scrolls across
+NAMED_PLAYERS = 8
+WIDTH_PER_TANK = 150
 
 
 '''
 This class handles the mutable terrain in the game.
+The terrain is a heightmap stored as a numpy array of floats, one entry per
+column of the battlefield, so generating it and digging craters work on whole
+columns at once. The battlefield can be wider than the screen, only the part
+of it in view is drawn.
 There are 3 types of terrain
 
 - Snow
@@ -15,8 +30,13 @@ There are 3 types of terrain
 '''
 
 class Map:
-    def __init__(self,screen, type, screen_dims):
-        random.seed()
+    '''
+    @param rng is the random.Random the terrain is generated from, a freshly
+    seeded one is used if it is not given
+    @param width is the width of the battlefield, the screen width if not given
+    '''
+    def __init__(self,screen, type, screen_dims, rng=None, width=None):
+        self.rng = rng if rng is not None else random.Random()
         self.screen = screen
         self.maps = {
             "Snow": {'terrain': self.snow_terrain, 'background': 'images/snow_bg.jpg', 'color': (255, 250, 250)},
@@ -24,77 +44,198 @@ class Map:
             "Desert": {'terrain': self.desert_terrain, 'background': 'images/desert_bg.jpeg', 'color': (236, 191, 13)},
             "Moon": {'terrain': self.moon_terrain, 'background': 'images/moon_bg.jpg', 'color': (205, 205, 205)}}
         map_names = [key for key in self.maps.keys()]
-        self.type = random.choice(map_names) if type is 'Random' else type
-        self.terrain = self.maps[self.type]['terrain'](screen_dims)
+        self.type = self.rng.choice(map_names) if type == 'Random' else type
         self.screen_dims = screen_dims
+        self.width = width or screen_dims[0]
+        self.terrain = self.maps[self.type]['terrain'](screen_dims, self.width)
+
+        # Bumped whenever the terrain changes, so results computed against the
+        # terrain (e.g. where shots land) can be cached per terrain state
+        self.version = 0
+
+        # Background + terrain rendered a chunk at a time by chunk index, and
+        # the screen sized view composed from them for the view_x it was
+        # composed at. Craters patch the chunks column by column.
+        self.chunks = assets.LRUCache(CHUNKS_KEPT)
+        self.surface = None
+        self.view_x = None
+
+        # Where the tanks on this map are, kept up to date by the players
+        self.tanks = spatial.TankGrid(self.width)
+
+
 
+    def draw(self, x=0):
+        self.screen.blit(self.get_surface(x), (0, 0))
+
+    '''
+    @param x is the battlefield column at the left edge of the screen
+    @return the background + terrain in view from x, a screen sized surface
+    '''
+    def get_surface(self, x=0):
+        if self.surface is None or x != self.view_x:
+            self.compose(x)
+        return self.surface
+
+    '''
+    Render the terrain in view from scratch
+    '''
+    def render(self, x=0):
+        self.chunks.clear()
+        self.compose(x)
+
+    '''
+    Put the view from x together out of the chunks it covers
+    '''
+    def compose(self, x):
+        if self.surface is None:
+            self.surface = assets.display_format(pygame.Surface(self.screen_dims))
+        for index in range(x // CHUNK_WIDTH, (x + self.screen_dims[0] - 1) // CHUNK_WIDTH + 1):
+            self.surface.blit(self.chunk(index), (index*CHUNK_WIDTH - x, 0))
+        self.view_x = x
+
+    def chunk(self, index):
+        return self.chunks.get(index, lambda: self.render_chunk(index))
+
+    def render_chunk(self, index):
+        surface = assets.display_format(pygame.Surface((CHUNK_WIDTH, self.screen_dims[1])))
+        left = index*CHUNK_WIDTH
+        self.render_strip(surface, left, left, left + CHUNK_WIDTH - 1)
+        return surface
 
+    '''
+    Re-render the terrain between columns first and last (inclusive) in the
+    chunks that are kept, the view is composed again on its next use
+    '''
+    def render_columns(self, first, last):
+        first = max(first - 1, 0)
+        last = min(last + 1, len(self.terrain) - 1)
+        for index in range(first // CHUNK_WIDTH, last // CHUNK_WIDTH + 1):
+            surface = self.chunks.entries.get(index)
+            if surface is not None:
+                self.render_strip(surface, index*CHUNK_WIDTH, first, last)
+        self.view_x = None
 
-    def draw(self):
-        self.screen.fill((200,200,200))
-        try:
-            background = pygame.image.load(self.maps[self.type]['background'])
-            background = pygame.transform.scale(background, self.screen_dims)
-        except pygame.error as message:
-            background = pygame.Surface(self.screen_dims)
-            background.fill((135, 206, 250))
-        background.set_alpha(200)
-        self.screen.blit(background, (0,0))
-        points = list(enumerate(self.terrain)) + [self.screen_dims, (0, self.screen_dims[1])]
-        pygame.draw.polygon(self.screen, self.maps[self.type]['color'], points)
+    '''
+    Render the background and terrain of columns first to last (inclusive)
+    onto surface, whose left edge is column left. The background repeats
+    every screen width. The terrain polygon runs a column past the strip on
+    each side and is clipped to it, so strips rasterize exactly like one
+    polygon over the whole terrain would.
+    '''
+    def render_strip(self, surface, left, first, last):
+        height = self.screen_dims[1]
+        background = assets.background(self.type, self.maps[self.type]['background'], self.screen_dims)
+        surface.set_clip(pygame.Rect(first - left, 0, last - first + 1, height))
+        x = first
+        while x <= last:
+            column = x % background.get_width()
+            span = min(last - x + 1, background.get_width() - column)
+            surface.blit(background, (x - left, 0), pygame.Rect(column, 0, span, height))
+            x += span
+        start = max(first - 1, 0)
+        end = min(last + 1, len(self.terrain) - 1)
+        if start < end:
+            points = list(zip(range(start - left, end - left + 1), self.terrain[start:end + 1].tolist()))
+            points += [(end - left, height), (start - left, height)]
+            pygame.draw.polygon(surface, self.maps[self.type]['color'], points)
+        surface.set_clip(None)
 
 
     '''
     We generate a function using four random numbers and draw
-    polygon of that function over the pixels of the screen
-    @param screen_dims is the tuple of (width, height) dimensions of the screen
-    @return a list of heights of the terrain at various x positions on the screen
-    '''
-    def snow_terrain(self, screen_dims):
-        a = random.randint(0.10 * screen_dims[1], 0.15 * screen_dims[1])
-        b = random.randint(0.10 * screen_dims[1], 0.15 * screen_dims[1])
-        c = random.randint(screen_dims[0]/50, screen_dims[0]/10)
-        d = random.randint(screen_dims[0]/50, screen_dims[0]/10)
-        return [0.5*screen_dims[1] - int(a * math.sin((1 + x) /c) + b * math.cos((1 + x) / d)) for x in range(screen_dims[0])]
-
-
-    def hill_terrain(self, screen_dims):
-        a = random.randint(0.05 * screen_dims[1], 0.08 * screen_dims[1])
-        b = random.randint(0.05 * screen_dims[1], 0.08 * screen_dims[1])
-        c = random.randint(screen_dims[0]/20, screen_dims[0]/10)
-        d = random.randint(screen_dims[0]/20, screen_dims[0]/10)
-        return [0.7*screen_dims[1] - int(a * math.sin((1 + x) /c) + b * math.cos((1 + x) / d)) for x in range(screen_dims[0])]
-
-    def desert_terrain(self, screen_dims):
-        a = random.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
-        b = random.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
-        c = random.randint(screen_dims[0]/5, screen_dims[0])
-        d = random.randint(screen_dims[0]/5, screen_dims[0])
-        return [0.9*screen_dims[1] - int(a * math.sin((1 + x) /c) + b * math.cos((1 + x) / d)) for x in range(screen_dims[0])]
-
-    def moon_terrain(self, screen_dims):
-        a = random.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
-        b = random.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
-        c = random.randint(screen_dims[0]/5, screen_dims[0])
-        d = random.randint(screen_dims[0]/5, screen_dims[0])
-        return [0.8*screen_dims[1] - int(a * math.sin((1 + x) /c) + b * math.cos((1 + x) / d)) for x in range(screen_dims[0])]
+    polygon of that function over the pixels of the battlefield
+    @param screen_dims is the tuple of (width, height) dimensions of the screen,
+    which set the size of the hills
+    @param width is the width of the battlefield
+    @return an array of heights of the terrain at various x positions on the battlefield
+    '''
+    def snow_terrain(self, screen_dims, width):
+        a = self.rng.randint(0.10 * screen_dims[1], 0.15 * screen_dims[1])
+        b = self.rng.randint(0.10 * screen_dims[1], 0.15 * screen_dims[1])
+        c = self.rng.randint(screen_dims[0]/50, screen_dims[0]/10)
+        d = self.rng.randint(screen_dims[0]/50, screen_dims[0]/10)
+        return wave_terrain(screen_dims, width, 0.5, a, b, c, d)
+
+
+    def hill_terrain(self, screen_dims, width):
+        a = self.rng.randint(0.05 * screen_dims[1], 0.08 * screen_dims[1])
+        b = self.rng.randint(0.05 * screen_dims[1], 0.08 * screen_dims[1])
+        c = self.rng.randint(screen_dims[0]/20, screen_dims[0]/10)
+        d = self.rng.randint(screen_dims[0]/20, screen_dims[0]/10)
+        return wave_terrain(screen_dims, width, 0.7, a, b, c, d)
+
+    def desert_terrain(self, screen_dims, width):
+        a = self.rng.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
+        b = self.rng.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
+        c = self.rng.randint(screen_dims[0]/5, screen_dims[0])
+        d = self.rng.randint(screen_dims[0]/5, screen_dims[0])
+        return wave_terrain(screen_dims, width, 0.9, a, b, c, d)
+
+    def moon_terrain(self, screen_dims, width):
+        a = self.rng.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
+        b = self.rng.randint(0.01 * screen_dims[1], 0.01 * screen_dims[1])
+        c = self.rng.randint(screen_dims[0]/5, screen_dims[0])
+        d = self.rng.randint(screen_dims[0]/5, screen_dims[0])
+        return wave_terrain(screen_dims, width, 0.8, a, b, c, d)
 
     def get_terrain(self):
         return self.terrain
 
+    '''
+    Height of the terrain at column x as a plain float
+    '''
+    def height(self, x):
+        return float(self.terrain[x])
+
+    '''
+    Replace the terrain, the battlefield takes the width of the new terrain
+    '''
     def set_terrain(self, terrain):
-        self.terrain = terrain
+        self.terrain = np.array(terrain, dtype=float)
+        if len(self.terrain) != self.width:
+            self.width = len(self.terrain)
+            tanks = list(self.tanks.where)
+            self.tanks = spatial.TankGrid(self.width)
+            for tank in tanks:
+                self.tanks.add(tank)
+        self.chunks.clear()
+        self.view_x = None
+        self.version += 1
 
+    '''
+    Dig a crater into the terrain, every column in reach of the blast at once
+    @return the (first, last) columns that changed, or None if nothing did
+    '''
     def apply_damage(self, center, radius):
-        for x in range(center[0]-radius, center[0]+radius+1):
-            if x<self.screen_dims[0] and x>0 and utils.dist(center,(x, self.terrain[x])) <= radius**2:
-                new_height = int(center[1] + math.sqrt(radius**2 - (center[0] - x)**2))
-                if new_height >= self.terrain[x]:
-                    self.terrain[x] = new_height
+        xs = np.arange(max(center[0] - radius, 1), min(center[0] + radius + 1, self.width))
+        heights = self.terrain[xs]
+        # Same reach test as utils.dist(center, (x, terrain[x])) <= radius**2
+        in_reach = np.sqrt((center[0] - xs)**2 + (center[1] - heights)**2) <= radius**2
+        new_heights = np.trunc(center[1] + np.sqrt(radius**2 - (center[0] - xs)**2))
+        dug = in_reach & (new_heights >= heights)
+        if not dug.any():
+            return None
+        self.terrain[xs[dug]] = new_heights[dug]
+        self.version += 1
+        changed = (int(xs[dug][0]), int(xs[dug][-1]))
+        self.render_columns(*changed)
+        return changed
 
-    def dump(self, f):
-        f.write(self.type+'\n')
-        f.write(str(self.terrain)+'\n')
 
+'''
+The shape shared by all terrain types, a sum of a sine and a cosine wave
+evaluated over every column of the battlefield at once
+@param level is the fraction of the screen height the terrain oscillates around
+'''
+def wave_terrain(screen_dims, width, level, a, b, c, d):
+    x = np.arange(width)
+    return level*screen_dims[1] - np.trunc(a * np.sin((1 + x) / c) + b * np.cos((1 + x) / d))
 
 
+'''
+@return the width of the battlefield for a battle of num_players tanks, the
+screen width unless it is a large battle
+'''
+def world_width(num_players, screen_width):
+    return screen_width if num_players <= NAMED_PLAYERS else num_players*WIDTH_PER_TANK
@@ -1,6 +1,6 @@
 import pygame
 import math
-from Tanks import weapon,gamestats,utils
+from Tanks import weapon,gamestats,assets
 import json
 
 '''
@@ -21,7 +21,58 @@ TANK_HEIGHT = 7
 TANK_WIDTH  = TANK_SCALE*TANK_HEIGHT
 TURRET_WIDTH = int(math.sqrt(TANK_HEIGHT))
 TURRET_LENGTH = 5*TANK_WIDTH/8
-TURRET_SPEED = math.pi/20
+TURRET_SPEED = weapon.angle_step
+HATCH_RADIUS = int(5 * TANK_WIDTH / 16)
+# The turret points at one of TURRET_STEPS + 1 angles, TURRET_SPEED apart from 0 to pi.
+# TURRET_ENDS holds where it ends for each, relative to the tank's (centerx, top),
+# rounded so that cos and sin leave no noise around whole pixels
+TURRET_STEPS = round(math.pi/TURRET_SPEED)
+TURRET_ENDS = [(round(-TURRET_LENGTH*math.cos(step*TURRET_SPEED), 9), round(-(HATCH_RADIUS/2) - TURRET_LENGTH*math.sin(step*TURRET_SPEED), 9))
+               for step in range(TURRET_STEPS + 1)]
+# Room around the tank body in its sprites for the hatch and turret
+SPRITE_PAD = math.ceil(TURRET_LENGTH) + TURRET_WIDTH
+SPRITE_PAD_TOP = math.ceil(HATCH_RADIUS/2 + TURRET_LENGTH) + TURRET_WIDTH
+
+
+'''
+@return the turret step nearest to angle
+'''
+def turret_step(angle):
+    return min(max(round(angle/TURRET_SPEED), 0), TURRET_STEPS)
+
+
+'''
+@return where the turret of a tank at rect ends when it points at angle
+'''
+def turret_endpoint(rect, angle):
+    dx, dy = TURRET_ENDS[turret_step(angle)]
+    return rect.centerx + dx, rect.top + dy
+
+
+'''
+Get the picture of a tank, body, hatch and turret, drawn once per color and
+turret step. The tank body's top left is at (SPRITE_PAD, SPRITE_PAD_TOP) in it.
+@return (sprite, the rect of the sprite that is drawn on)
+'''
+def tank_sprite(color, step):
+    color = tuple(color[:3])
+    return assets.tanks.get((color, step), lambda: draw_tank(color, step))
+
+
+def draw_tank(color, step):
+    surface = pygame.Surface((TANK_WIDTH + 2*SPRITE_PAD, TANK_HEIGHT + SPRITE_PAD_TOP))
+    # Any color but the tank's own will do as the transparent one
+    key = tuple(255 - c for c in color)
+    surface.fill(key)
+    surface.set_colorkey(key, pygame.RLEACCEL)
+    body = pygame.Rect((SPRITE_PAD, SPRITE_PAD_TOP), (TANK_WIDTH, TANK_HEIGHT))
+    pygame.draw.rect(surface, color, body)
+    pygame.draw.circle(surface, color, (body.centerx, body.top), HATCH_RADIUS)
+    pygame.draw.line(surface, color, (body.centerx, body.top - (HATCH_RADIUS/2)), turret_endpoint(body, step*TURRET_SPEED), TURRET_WIDTH)
+    surface = assets.display_format(surface)
+    return surface, surface.get_bounding_rect()
+
+
 class Player():
     def __init__(self, screen, game_map, name, color, init_x, init_y, screen_dims, fps):
         # necessary fields for drawing
@@ -33,12 +84,16 @@ class Player():
         self.screen_height = screen_dims[1]
         self.color = color
         self.rect = pygame.Rect((init_x-(TANK_WIDTH/2), init_y - (TANK_HEIGHT/2)), (TANK_WIDTH, TANK_HEIGHT))
-        self.hatch_radius = int(5 * TANK_WIDTH / 16)
+        self.hatch_radius = HATCH_RADIUS
         self.turret_angle = 0
-        self.turret_endpoint = (self.rect.centerx - TURRET_LENGTH*math.cos(self.turret_angle),self.rect.top - (self.hatch_radius/2) -TURRET_LENGTH*math.sin(self.turret_angle))
+        self.update_turret()
         self.speed = 3
         self.movement = [0, 0]
-        self.death_radii = []
+        # The blast a destroyed tank goes up in, played back to front
+        self.death_blast = None
+        self.death_frames_left = 0
+
+        game_map.tanks.add(self)
 
         # Game fields
         self.total_score = 0
@@ -56,8 +111,12 @@ class Player():
         self.max_fuel = 300
         self.upgrades = {"Upgrade Armor": 250, "Upgrade Speed": 0, "Add Fuel Capacity" : 300, "Health Recharge": 1}
 
-        #statsbar
-        self.stats =  gamestats.Gamestats(screen, screen_dims)
+        #statsbar, created when first drawn so headless games never need it
+        self.stats = None
+
+        # Who plays this tank: None for a person at the keyboard, else
+        # something with act(engine)/shop(player) like ai.Computer
+        self.controller = None
 
     '''
     The following functions all update the model as stored in the player
@@ -88,19 +147,17 @@ class Player():
         else:
             self.movement = [0,0]
         self.rect.center = tuple(map(sum, zip(self.rect.center, self.movement)))
-        if self.rect.left > self.screen_width:
+        width = self.game_map.width
+        if self.rect.left > width:
             self.rect.right = 0
         elif self.rect.right < 0:
-            self.rect.left = self.screen_width
-        if self.rect.centerx > 0 and self.rect.centerx < self.screen_width:
-            self.rect.centery = self.game_map.get_terrain()[self.rect.centerx]+(TANK_HEIGHT/2)
+            self.rect.left = width
+        if self.rect.centerx > 0 and self.rect.centerx < width:
+            self.rect.centery = self.game_map.height(self.rect.centerx)+(TANK_HEIGHT/2)
+        self.game_map.tanks.move(self)
 
         # Adjust turret angle
-        self.turret_angle += (direction * TURRET_SPEED)
-        if self.turret_angle > math.pi:
-            self.turret_angle = math.pi
-        if self.turret_angle < 0:
-            self.turret_angle = 0
+        self.turret_angle = turret_step(self.turret_angle + direction*TURRET_SPEED)*TURRET_SPEED
 
         # adjust the power
         if power_up:
@@ -108,12 +165,25 @@ class Player():
         if power_down:
             self.power = max(self.power-1, 0)
 
+        self.update_turret()
+
+    '''
+    Recompute where the turret ends (where shells leave the tank)
+    from the tank position and turret angle, which is put on its step
+    '''
+    def update_turret(self):
+        self.turret_step = turret_step(self.turret_angle)
+        self.turret_angle = self.turret_step*TURRET_SPEED
+        self.turret_endpoint = turret_endpoint(self.rect, self.turret_angle)
+
     '''
     Place the player at a certain location on the map programmatically
     '''
 
     def place_player(self, x, y):
         self.rect.center = (x,y)
+        self.game_map.tanks.move(self)
+        self.update_turret()
 
     '''
     Update the player's score based on whether the enemy was destroyed or
@@ -184,30 +254,54 @@ class Player():
         self.destroyed = False
         self.power = 0.5*self.health
         self.movement = [0,0]
+        self.game_map.tanks.remove(self)
         self.game_map = new_game_map
-        self.rect.centery = new_game_map.get_terrain()[self.rect.centerx]
+        self.rect.centery = new_game_map.height(self.rect.centerx)
+        new_game_map.tanks.add(self)
+        self.update_turret()
 
     '''
     Draw function for the player class as well as helpers for when player explodes
     @param showstats is True if we need to show this players stats (i.e. it is this player's turn)
+    @param view_x is the battlefield column at the left edge of the screen
+    @return the list of rects that were drawn (the stats box if shown, then the tank)
     '''
 
-    def draw(self, show_stats):
-        if show_stats:
-            self.stats.draw(self)
+    def draw(self, show_stats, view_x=0):
+        drawn = [self.draw_stats()] if show_stats else []
        # if self.rect.centerx > 0 and self.rect.centerx < self.screen_width:
         #    self.rect.centery = self.game_map.get_terrain()[self.rect.centerx]+(TANK_HEIGHT/2)
-        pygame.draw.rect(self.screen, self.color, self.rect)
-        pygame.draw.circle(self.screen, self.color, (self.rect.centerx, self.rect.top) ,self.hatch_radius)
-        turret_end_x = self.rect.centerx - TURRET_LENGTH*math.cos(self.turret_angle)
-        turret_end_y = self.rect.top - (self.hatch_radius/2) -TURRET_LENGTH*math.sin(self.turret_angle)
-        self.turret_endpoint = (turret_end_x, turret_end_y)
-        pygame.draw.line(self.screen, self.color, (self.rect.centerx, self.rect.top - (self.hatch_radius/2)), self.turret_endpoint, TURRET_WIDTH)
+        sprite, bounds = tank_sprite(self.color, self.turret_step)
+        position = (self.rect.left - view_x - SPRITE_PAD + bounds.x, self.rect.top - SPRITE_PAD_TOP + bounds.y)
+        drawn.append(self.screen.blit(sprite, position, bounds))
+        return drawn
 
-    def draw_death(self):
-        color, radius = self.death_radii.pop()
-        pygame.draw.circle(self.screen, color, self.rect.center, radius)
-        return True if self.death_radii else False
+    '''
+    Draw this player's stats box, which stays on screen wherever the tank is
+    @return the rect that was drawn
+    '''
+    def draw_stats(self):
+        if self.stats is None:
+            self.stats = gamestats.Gamestats(self.screen, (self.screen_width, self.screen_height))
+        return self.stats.draw(self)
+
+    '''
+    Move the death blast on by one simulation tick, the tank is destroyed
+    once the blast is over
+    '''
+    def advance_death(self):
+        self.death_frames_left -= 1
+        if not self.death_frames_left:
+            self.destroyed = True
+
+    '''
+    Draw the current frame of the death blast
+    @param view_x is the battlefield column at the left edge of the screen
+    @return the rect that was drawn
+    '''
+    def draw_death(self, view_x=0):
+        sprite, radius = assets.blast('Death', self.fps, self.death_blast.frames)[self.death_frames_left - 1]
+        return self.screen.blit(sprite, (self.rect.centerx - view_x - radius, self.rect.centery - radius))
 
 
     '''
@@ -215,15 +309,19 @@ class Player():
     Most of these functions communicate with the weapons module
     '''
 
-    def get_shot_trajectory(self):
+    def get_shot_trajectory(self, target=None):
         if not self.weapons[self.current_weapon]:
             return []
         self.weapons[self.current_weapon] = self.weapons[self.current_weapon] - 1
-        return weapon.weapons[self.current_weapon]['get_path'](self.turret_endpoint, self.fps, self.power, self.turret_angle, self.game_map.get_terrain())
+        return weapon.weapons[self.current_weapon]['get_path'](self.turret_endpoint, self.fps, self.power, self.turret_angle, self.game_map.get_terrain(), target)
 
+    '''
+    @return (max radius, frames) of the current weapon's blast, the frames
+    being a shared tuple of (color, radius) in the order they are shown
+    '''
     def get_explosion_radii(self):
-        blasts = weapon.explode(self.current_weapon, self.fps)
-        return max([blast[1] for blast in blasts]),list(reversed(blasts))
+        blast = weapon.explode(self.current_weapon, self.fps)
+        return blast.max_radius, blast.frames
 
     def get_shell_radius(self):
         return weapon.weapons[self.current_weapon]['shell_radius']
@@ -235,7 +333,8 @@ class Player():
         self.health = max(self.health - damage*self.armor_scale_factor, 0)
         if self.health<=0:
             self.exploding = True
-            self.death_radii = weapon.explode('Death', self.fps)
+            self.death_blast = weapon.explode('Death', self.fps)
+            self.death_frames_left = len(self.death_blast.frames)
         self.power = min(self.power, self.health)
 
     def health_recharge(self):
@@ -244,38 +343,26 @@ class Player():
             self.health+=50
 
     def in_blast_radius(self, epicenter, radius):
-        l = self.rect.left
-        r = self.rect.right
-
-        # now calculate euclidean distances to key points and return whether they are within radius of epicenter
-        if utils.dist(epicenter,self.rect.center) <= radius:
-            return True
-        elif utils.dist(epicenter, (l,self.rect.centery)) < radius or utils.dist(epicenter, (r, self.rect.centery)) < radius:
+        # Squared distances, in whole pixels, to the center and both ends of the tank
+        x, y = epicenter
+        dy = (y - self.rect.centery)**2
+        if (x - self.rect.centerx)**2 + dy <= radius**2:
             return True
-        else:
-            return False
-
-    '''
-    Write out this player object to a file
-    '''
-    def dump(self, f):
-        weapon_list = json.dumps(self.weapons)
-        vars = [self.name,list(self.color),list(self.rect.center), self.speed, self.total_score, self.health, self.fuel, self.exploding, self.destroyed, self.current_weapon,weapon_list, self.power, self.armor_scale_factor,self.max_fuel]
-        f.write('\n'.join(list(map(str, vars))))
-        f.write('\n')
+        return (x - self.rect.left)**2 + dy < radius**2 or (x - self.rect.right)**2 + dy < radius**2
 
     '''
-    Read this player object from a save file
+    Read this player object's stats from a text save file (the format of
+    older versions of the game, see savefile.read_text)
     '''
     def load(self, fp):
         self.speed = int(fp.readline()[:-1])
         self.total_score = int(fp.readline()[:-1])
-        self.health = int(fp.readline()[:-1])
+        self.health = json.loads(fp.readline())
         self.fuel = int(fp.readline()[:-1])
         self.exploding = fp.readline()[:-1]=='True'
         self.destroyed = fp.readline()[:-1]=='True'
         self.current_weapon = fp.readline()[:-1]
         self.weapons = json.loads((fp.readline()[0:-1]))
         self.power = float(fp.readline()[:-1])
-        self.armor_scale_factor = int(fp.readline()[:-1])
+        self.armor_scale_factor = json.loads(fp.readline())
         self.max_fuel = int(fp.readline()[:-1])
\ No newline at end of file
@@ -0,0 +1,167 @@
+import os
+import csv
+import time
+import pygame
+from collections import deque
+from Tanks import assets
+
+'''
+Frame time profiler for the game screens.
+
+The loops in game.py call mark(phase) after each phase of a frame, which
+charges the time since the previous mark to that phase, and frame() right
+after the clock tick that starts the next frame. The time spent waiting in
+the clock tick is charged to 'idle', so the rest of a frame is the time the
+game actually worked for.
+
+While enabled (F3 during a round) an overlay shows percentiles of the work
+time of the last WINDOW frames and where the time went, and every frame is
+recorded. At the end of each round (and store visit) the recorded frames
+are written to a CSV file in PROFILE_DIR, one row per frame and one column
+per phase, in ms.
+While disabled every call returns straight away.
+'''
+
+PHASES = ('events', 'ai', 'move', 'flight', 'damage', 'draw', 'present', 'idle')
+WINDOW = 120
+PERCENTILES = (50, 95, 99)
+PROFILE_DIR = os.path.join(assets.ROOT, 'profiles')
+# The overlay text is rendered again every this many frames, so it can be read
+REFRESH_FRAMES = 10
+FONT = ('Courier New', 12, True)
+TEXT_COLOR = (255, 255, 255)
+BACK_COLOR = (0, 0, 0)
+
+
+class Profiler:
+    def __init__(self, window=WINDOW, directory=PROFILE_DIR):
+        self.enabled = False
+        self.directory = directory
+        self.last = 0
+        self.current = dict.fromkeys(PHASES, 0)
+        # Work time (everything but idle) of the last frames, in seconds
+        self.work = deque(maxlen=window)
+        self.totals = dict.fromkeys(PHASES, 0)
+        self.rows = []
+        self.name = 'round'
+        self.overlay = None
+        self.frames_drawn = 0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.last = time.perf_counter()
+        self.current = dict.fromkeys(PHASES, 0)
+        self.overlay = None
+
+    '''
+    Charge the time since the last mark to phase
+    '''
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    '''
+    Close the frame that just ended, call right after the clock tick
+    '''
+    def frame(self):
+        if not self.enabled:
+            return
+        self.mark('idle')
+        current = self.current
+        self.work.append(sum(current.values()) - current['idle'])
+        for phase in PHASES:
+            self.totals[phase] += current[phase]
+        self.rows.append(current)
+        self.current = dict.fromkeys(PHASES, 0)
+
+    '''
+    @return the work time percentiles of the recent frames in ms, by percentile
+    '''
+    def percentiles(self):
+        times = sorted(self.work)
+        if not times:
+            return {p: 0 for p in PERCENTILES}
+        return {p: 1000*times[min(len(times) - 1, len(times)*p//100)] for p in PERCENTILES}
+
+    '''
+    Draw the overlay in the top left corner of the screen
+    @return the rect drawn, None when disabled
+    '''
+    def draw(self, screen):
+        if not self.enabled:
+            return None
+        if self.overlay is None or self.frames_drawn % REFRESH_FRAMES == 0:
+            self.overlay = self.render()
+        self.frames_drawn += 1
+        return screen.blit(self.overlay, (0, 0))
+
+    def render(self):
+        percentiles = self.percentiles()
+        lines = ['frame ' + ' '.join('p{} {:5.1f}'.format(p, ms) for p, ms in percentiles.items()) + ' ms']
+        spent = sum(self.totals.values()) - self.totals['idle']
+        for phase in PHASES[:-1]:
+            share = 100*self.totals[phase]/spent if spent else 0
+            lines.append('{:<8}{:5.1f}%'.format(phase, share))
+        font = assets.font(*FONT)
+        height = font.get_linesize()
+        surface = pygame.Surface((max(font.size(line)[0] for line in lines) + 6, height*len(lines) + 4))
+        surface.fill(BACK_COLOR)
+        surface.set_alpha(180)
+        for index, line in enumerate(lines):
+            surface.blit(font.render(line, True, TEXT_COLOR), (3, 2 + index*height))
+        return surface
+
+    '''
+    Start recording a new run of frames (a round, a store visit)
+    @param name goes into the name of the file save() writes
+    '''
+    def start(self, name):
+        self.name = name
+        self.rows = []
+        self.totals = dict.fromkeys(PHASES, 0)
+        self.last = time.perf_counter()
+
+    '''
+    Write the frames recorded since start() to the profile directory
+    @return the path written, None when no frames were recorded
+    '''
+    def save(self):
+        if not self.rows:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '{}-{}.csv'.format(self.name, time.strftime('%Y%m%d-%H%M%S')))
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('frame', 'work') + PHASES)
+            for index, row in enumerate(self.rows):
+                work = sum(row.values()) - row['idle']
+                writer.writerow([index, '{:.3f}'.format(1000*work)] + ['{:.3f}'.format(1000*row[phase]) for phase in PHASES])
+        self.rows = []
+        return path
+
+
+# The profiler of the running game, shared by its screens and the engine
+profile = Profiler()
+
+
+'''
+Add the overlay to a frame and present it, charging the time to draw and present
+'''
+def present(renderer):
+    if profile.enabled:
+        renderer.add(profile.draw(renderer.screen))
+    profile.mark('draw')
+    renderer.present()
+    profile.mark('present')
+
+
+'''
+Turn the profiler on or off (the F3 key)
+'''
+def toggle(renderer):
+    profile.toggle()
+    # Paint over the overlay when it goes away
+    renderer.invalidate()
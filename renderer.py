@@ -0,0 +1,84 @@
+import pygame
+
+'''
+Renderers decide how a game frame gets from the screen surface to the display.
+
+Every element drawn during a frame reports the rectangle it covered through
+add(). The plain Renderer ignores them, repaints the whole background and
+flips the display. The DirtyRenderer repaints only the rectangles drawn on the
+previous frame and pushes just the changed areas with pygame.display.update,
+so the cost of a frame follows what moved instead of the window size.
+'''
+
+class Renderer:
+    def __init__(self, screen):
+        self.screen = screen
+
+    '''
+    Repaint the background before the elements of a frame are drawn
+    @param background is the full screen sized surface to repaint from
+    '''
+    def restore(self, background):
+        self.screen.blit(background, (0, 0))
+
+    '''
+    Report an area that was drawn this frame
+    @return the rect, so calls can wrap pygame.draw and blit calls
+    '''
+    def add(self, rect):
+        return rect
+
+    '''
+    Report an area of the background that changed (e.g. a crater)
+    '''
+    def damage(self, rect):
+        pass
+
+    '''
+    Force the next frame to repaint and push the whole screen
+    '''
+    def invalidate(self):
+        pass
+
+    def present(self):
+        pygame.display.flip()
+
+
+class DirtyRenderer(Renderer):
+    def __init__(self, screen):
+        Renderer.__init__(self, screen)
+        # Rects drawn last frame, they get repainted from the background next frame
+        self.stale = []
+        # Rects repainted this frame, pushed along with the newly drawn ones
+        self.restored = []
+        self.dirty = []
+        self.full = True
+
+    def restore(self, background):
+        if self.full:
+            self.screen.blit(background, (0, 0))
+        else:
+            for rect in self.stale:
+                self.screen.blit(background, rect, rect)
+            self.restored.extend(self.stale)
+        self.stale = []
+
+    def add(self, rect):
+        self.dirty.append(rect)
+        return rect
+
+    def damage(self, rect):
+        self.stale.append(rect)
+
+    def invalidate(self):
+        self.full = True
+
+    def present(self):
+        if self.full:
+            pygame.display.flip()
+            self.full = False
+        else:
+            pygame.display.update(self.restored + self.dirty)
+        self.stale.extend(self.dirty)
+        self.restored = []
+        self.dirty = []
@@ -0,0 +1,284 @@
+import io
+import os
+import sys
+import time
+import zlib
+import random
+import struct
+import argparse
+from Tanks import savefile, assets
+from Tanks.engine import Engine, Action
+
+'''
+Recording and playing back whole matches.
+
+A match is played from one seed: the maps of the rounds after the first,
+the seating order and the computer players' aim all come from a
+random.Random seeded with it. A replay file holds that seed, the game as it
+stood when the match started (in the save file format, so loaded games
+replay too), every Action applied during the rounds and the purchases of
+each store visit. Feeding those back reproduces the match frame for frame,
+on screen (game.play_replay) or headless as fast as the CPU allows
+(play_headless).
+
+File layout, little endian: HEADER (MAGIC, VERSION, seed, fps, screen
+width and height), then zlib compressed
+-   the length of the starting game and the game in the save file format
+-   events: ACTION runs of one Action repeated count times (with the target
+    point after it when there is one), and STORE records with the number
+    of purchases followed by each (player index, item name)
+Idle ticks make up most of a round, so runs keep files small.
+'''
+
+MAGIC = b'TNKR'
+# Version 2: shells go off on tanks they hit on their way, older matches play out differently
+# Version 3: air strike targets on battlefields wider than the screen, x is an int32
+# Version 4: shells left of the map or above it are on the pixels the original game put them on
+VERSION = 4
+EXTENSION = '.rpl'
+REPLAY_DIR = os.path.join(assets.ROOT, 'replays')
+HEADER = struct.Struct('<4sHQHHH')
+LENGTH = struct.Struct('<I')
+ACTION = struct.Struct('<cBHh')
+TARGET = struct.Struct('<ih')
+STORE = struct.Struct('<cH')
+PURCHASE = struct.Struct('<HB')
+ACTION_TAG = b'A'
+STORE_TAG = b'S'
+MAX_RUN = 255
+# Bits of an Action's flags, past the move, angle and power fields (2 bits each)
+FIRE = 1 << 6
+RECHARGE = 1 << 7
+HAS_TARGET = 1 << 8
+
+
+def _flags(action):
+    flags = (action.move + 1) | (action.angle + 1) << 2 | (action.power + 1) << 4
+    if action.fire:
+        flags |= FIRE
+    if action.recharge:
+        flags |= RECHARGE
+    if action.target is not None:
+        flags |= HAS_TARGET
+    return flags
+
+
+def _action(flags, weapon, target):
+    return Action(move=(flags & 3) - 1, angle=(flags >> 2 & 3) - 1, power=(flags >> 4 & 3) - 1, weapon=weapon,
+                  fire=bool(flags & FIRE), target=target, recharge=bool(flags & RECHARGE))
+
+
+'''
+Records a match as it is played
+'''
+class Recorder:
+    '''
+    @param seed is the seed the match is played from
+    @param game_map, players and round_num are the game as the match starts
+    '''
+    def __init__(self, seed, game_map, players, round_num, fps, screen_dims):
+        self.seed = seed
+        self.fps = fps
+        self.screen_dims = screen_dims
+        start = io.BytesIO()
+        savefile.write(start, game_map, players, round_num)
+        self.start = start.getvalue()
+        self.events = io.BytesIO()
+        # The Action being repeated and how many times so far
+        self.run = None
+        self.count = 0
+
+    def action(self, action):
+        if action == self.run and self.count < MAX_RUN:
+            self.count += 1
+            return
+        self.end_run()
+        self.run = action
+        self.count = 1
+
+    def end_run(self):
+        if self.run is None:
+            return
+        action = self.run
+        self.events.write(ACTION.pack(ACTION_TAG, self.count, _flags(action), action.weapon))
+        if action.target is not None:
+            self.events.write(TARGET.pack(int(action.target[0]), int(action.target[1])))
+        self.run = None
+        self.count = 0
+
+    '''
+    @param purchases are the (player index, item) bought at a store visit, in order
+    '''
+    def store(self, purchases):
+        self.end_run()
+        self.events.write(STORE.pack(STORE_TAG, len(purchases)))
+        for index, item in purchases:
+            name = item.encode('utf-8')
+            self.events.write(PURCHASE.pack(index, len(name)) + name)
+
+    def dump(self):
+        self.end_run()
+        body = LENGTH.pack(len(self.start)) + self.start + self.events.getvalue()
+        return HEADER.pack(MAGIC, VERSION, self.seed, self.fps, *self.screen_dims) + zlib.compress(body)
+
+    '''
+    Write the replay to a new file in directory
+    @return the path written
+    '''
+    def save(self, directory=REPLAY_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'replay-{}-{}{}'.format(time.strftime('%Y%m%d-%H%M%S'), self.seed, EXTENSION))
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(self.dump())
+        os.replace(temp, path)
+        return path
+
+
+'''
+A recorded match, handing out its Actions and purchases in the order they
+were recorded
+'''
+class Replay:
+    def __init__(self, data):
+        magic, version, self.seed, self.fps, width, height = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('not a replay file')
+        if version != VERSION:
+            raise ValueError('replay version {} is not one this game reads'.format(version))
+        self.screen_dims = (width, height)
+        body = zlib.decompress(data[HEADER.size:])
+        length = LENGTH.unpack_from(body, 0)[0]
+        self.start = body[LENGTH.size:LENGTH.size + length]
+        self.events = self.parse(body, LENGTH.size + length)
+        self.position = 0
+        self.repeat = 0
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return Replay(f.read())
+
+    '''
+    @return the events as ('action', Action, count) and ('store', purchases)
+    '''
+    @staticmethod
+    def parse(body, offset):
+        events = []
+        while offset < len(body):
+            tag = body[offset:offset + 1]
+            if tag == ACTION_TAG:
+                _, count, flags, weapon = ACTION.unpack_from(body, offset)
+                offset += ACTION.size
+                target = None
+                if flags & HAS_TARGET:
+                    target = TARGET.unpack_from(body, offset)
+                    offset += TARGET.size
+                events.append(('action', _action(flags, weapon, target), count))
+            elif tag == STORE_TAG:
+                _, count = STORE.unpack_from(body, offset)
+                offset += STORE.size
+                purchases = []
+                for _ in range(count):
+                    index, length = PURCHASE.unpack_from(body, offset)
+                    offset += PURCHASE.size
+                    purchases.append((index, body[offset:offset + length].decode('utf-8')))
+                    offset += length
+                events.append(('store', purchases))
+            else:
+                raise ValueError('damaged replay file')
+        return events
+
+    '''
+    The game as the match started, and the random.Random the rest of the
+    match is played from
+    @return (players, game_map, round number, rng)
+    '''
+    def begin(self, screen):
+        self.position = 0
+        self.repeat = 0
+        players, game_map, round_num = savefile.read(self.start, screen, self.screen_dims, self.fps)
+        return players, game_map, round_num, random.Random(self.seed)
+
+    def peek(self):
+        return self.events[self.position] if self.position < len(self.events) else None
+
+    '''
+    @return the next Action, None when the round's Actions have run out
+    '''
+    def next_action(self):
+        event = self.peek()
+        if event is None or event[0] != 'action':
+            return None
+        self.repeat += 1
+        if self.repeat == event[2]:
+            self.position += 1
+            self.repeat = 0
+        return event[1]
+
+    '''
+    @return the purchases of the next store visit, None when there is none
+    '''
+    def next_store(self):
+        event = self.peek()
+        if event is None or event[0] != 'store':
+            return None
+        self.position += 1
+        return event[1]
+
+    def finished(self):
+        return self.position >= len(self.events)
+
+
+'''
+Play a replay back with no display and no clock
+@return (rounds played, ticks played, players)
+'''
+def play_headless(replay):
+    from Tanks import game
+    players, game_map, _, rng = replay.begin(None)
+    game.seed_controllers(players, rng)
+    rounds = 0
+    ticks = 0
+    while True:
+        engine = Engine(game_map, players)
+        while not engine.game_ended():
+            action = replay.next_action()
+            if action is None:
+                return rounds, ticks, players
+            engine.tick(action)
+            ticks += 1
+        rounds += 1
+        purchases = replay.next_store()
+        if purchases is None:
+            return rounds, ticks, players
+        for index, item in purchases:
+            game.buy(players[index], item)
+        game_map = game.next_round(None, players, rng)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play back a recorded match.')
+    parser.add_argument('replay', help='replay file (.rpl)')
+    parser.add_argument('--headless', action='store_true', help='play without a display, as fast as possible')
+    parser.add_argument('--speed', type=float, default=1, help='playback speed on screen, 0 for as fast as possible')
+    args = parser.parse_args(argv)
+    try:
+        replay = Replay.load(args.replay)
+    except (OSError, ValueError, zlib.error, struct.error) as e:
+        sys.stderr.write('{}: {}\n'.format(args.replay, e))
+        return 1
+    if args.headless:
+        start = time.perf_counter()
+        rounds, ticks, players = play_headless(replay)
+        print('{} rounds, {} ticks in {:.2f} s'.format(rounds, ticks, time.perf_counter() - start))
+        for player in sorted(players, key=lambda p: p.total_score, reverse=True):
+            print('{:<20}{:>8}'.format(player.name, player.total_score))
+    else:
+        from Tanks import game
+        game.play_replay(replay, args.speed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+from collections import namedtuple
+import numpy as np
+from Tanks import weapon, ai
+from Tanks.map import Map
+from Tanks.player import Player
+
+'''
+The binary save file format.
+
+All numbers are little endian. A file is
+-   the header: MAGIC, the format VERSION, the map type, the number of
+    terrain columns, the number of players, the number of weapon names and
+    (from version 2) the round being played
+-   the weapon names, each one byte of length and the UTF-8 name. The ammo
+    of every player is stored in this order, so adding or reordering weapons
+    in weapon.py does not break older files
+-   the terrain, one int16 height per column (craters and terrain generation
+    only ever make whole pixel heights)
+-   one fixed size record (PLAYERS) per player, followed by its ammo as one
+    int16 per weapon name (-1 for unlimited, NOT_OWNED for weapons the player
+    never bought). From version 3 the tank's x is an int32, battlefields can
+    be wider than an int16 reaches
+
+Files are read through a memory map, so loading only touches the bytes it
+needs and the terrain goes straight from the file into the map's array.
+The text files saved by older versions of the game (.txt) can still be
+loaded with read_text, and converted with
+    python3 -m Tanks.savefile saved_games/*.txt
+'''
+
+MAGIC = b'TNKS'
+VERSION = 3
+EXTENSION = '.sav'
+PREFIX = struct.Struct('<4sH')
+HEADERS = {1: struct.Struct('<4sH16sHHH'), 2: struct.Struct('<4sH16sHHHH'), 3: struct.Struct('<4sH16sHHHH')}
+# name, color, center, turret angle, power, health, armor scale factor,
+# speed, fuel, max fuel, total score, round score, current weapon,
+# exploding, destroyed, controller, upgrades (in weapon.upgrades order).
+# Names longer than NAME_BYTES of UTF-8 are cut short
+NAME_BYTES = 32
+PLAYERS = {1: struct.Struct('<32s3Bhhdddd5iH3B4i'), 2: struct.Struct('<32s3Bhhdddd5iH3B4i'),
+           3: struct.Struct('<32s3Bihdddd5iH3B4i')}
+NOT_OWNED = -32768
+# Controller codes, 0 is a person at the keyboard
+CONTROLLERS = [None] + list(ai.DIFFICULTIES)
+
+Snapshot = namedtuple('Snapshot', ['map_type', 'terrain', 'round_num', 'names', 'players'])
+
+
+def _fixed(string, size):
+    data = string.encode('utf-8')[:size]
+    # Never cut a character in half
+    return data.decode('utf-8', 'ignore').encode('utf-8')
+
+
+'''
+The state of a game as plain values, copied so that it can be written out
+(e.g. on another thread) while the game goes on
+@return a Snapshot
+'''
+def snapshot(game_map, players, round_num=1):
+    names = list(weapon.weapons)
+    records = []
+    for player in players:
+        controller = player.controller.difficulty if player.controller is not None else None
+        record = (_fixed(player.name, NAME_BYTES), *player.color[:3],
+                  player.rect.centerx, player.rect.centery, player.turret_angle,
+                  player.power, player.health, player.armor_scale_factor,
+                  player.speed, player.fuel, player.max_fuel, player.total_score, player.round_score,
+                  names.index(player.current_weapon), player.exploding, player.destroyed,
+                  CONTROLLERS.index(controller),
+                  *[player.upgrades[upgrade] for upgrade in weapon.upgrades])
+        records.append((record, [player.weapons.get(name, NOT_OWNED) for name in names]))
+    return Snapshot(game_map.type, np.rint(game_map.terrain).astype('<i2'), round_num, names, records)
+
+
+'''
+Write a snapshot out in the binary format
+@param f is a file opened for binary writing
+'''
+def write_snapshot(f, state):
+    f.write(HEADERS[VERSION].pack(MAGIC, VERSION, _fixed(state.map_type, 16), len(state.terrain),
+                                  len(state.players), len(state.names), state.round_num))
+    for name in state.names:
+        data = _fixed(name, 255)
+        f.write(bytes([len(data)]) + data)
+    f.write(state.terrain.tobytes())
+    for record, ammo in state.players:
+        f.write(PLAYERS[VERSION].pack(*record))
+        f.write(np.array(ammo, dtype='<i2').tobytes())
+
+
+def write(f, game_map, players, round_num=1):
+    write_snapshot(f, snapshot(game_map, players, round_num))
+
+
+'''
+Write a snapshot to a file without ever leaving a half written file behind:
+it goes to a hidden temporary file next to it first, which then replaces
+the file in one step
+'''
+def save_snapshot(path, state):
+    directory, name = os.path.split(path)
+    temp = os.path.join(directory, '.' + name + '.tmp')
+    try:
+        with open(temp, 'wb') as f:
+            write_snapshot(f, state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+'''
+The death blast of a tank is not saved, so a tank saved while its blast was
+still going off (e.g. by the autosave right after the shot that killed it)
+is loaded as destroyed
+'''
+def _finish_death(player):
+    if player.exploding:
+        player.destroyed = True
+
+
+'''
+Read the header and weapon names
+@return (version, map type, terrain columns, players, round, weapon names, offset of the terrain)
+'''
+def _header(buffer):
+    magic, version = PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError('not a save file')
+    if version not in HEADERS:
+        raise ValueError('save file version {} is not one this game reads'.format(version))
+    fields = HEADERS[version].unpack_from(buffer, 0)
+    map_type, columns, num_players, num_names = fields[2:6]
+    round_num = fields[6] if version >= 2 else 1
+    offset = HEADERS[version].size
+    names = []
+    for _ in range(num_names):
+        length = buffer[offset]
+        names.append(bytes(buffer[offset + 1:offset + 1 + length]).decode('utf-8'))
+        offset += 1 + length
+    return version, map_type.rstrip(b'\0').decode('utf-8'), columns, num_players, round_num, names, offset
+
+
+'''
+Read a game from a buffer holding a binary save file (bytes, an mmap ...)
+@return (players, game_map, round number)
+@raise ValueError if it is not a save file this game can read, or is cut short
+'''
+def read(buffer, screen, screen_dims, fps):
+    try:
+        return _read(buffer, screen, screen_dims, fps)
+    except (struct.error, IndexError) as e:
+        raise ValueError('damaged save file ({})'.format(e))
+
+
+def _read(buffer, screen, screen_dims, fps):
+    version, map_type, columns, num_players, round_num, names, offset = _header(buffer)
+    num_names = len(names)
+    record_format = PLAYERS[version]
+    game_map = Map(screen, map_type, screen_dims)
+    game_map.set_terrain(np.frombuffer(buffer, dtype='<i2', count=columns, offset=offset))
+    offset += 2*columns
+
+    players = []
+    for _ in range(num_players):
+        record = record_format.unpack_from(buffer, offset)
+        offset += record_format.size
+        ammo = np.frombuffer(buffer, dtype='<i2', count=num_names, offset=offset).tolist()
+        offset += 2*num_names
+        name = record[0].rstrip(b'\0').decode('utf-8')
+        x, y = record[4:6]
+        player = Player(screen, game_map, name, record[1:4], x, y, screen_dims, fps)
+        player.rect.center = (x, y)
+        game_map.tanks.move(player)
+        (player.turret_angle, player.power, player.health, player.armor_scale_factor,
+         player.speed, player.fuel, player.max_fuel, player.total_score, player.round_score) = record[6:15]
+        player.update_turret()
+        player.current_weapon = names[record[15]]
+        player.exploding, player.destroyed = bool(record[16]), bool(record[17])
+        _finish_death(player)
+        controller = CONTROLLERS[record[18]]
+        player.controller = ai.Computer(controller) if controller is not None else None
+        player.upgrades = dict(zip(weapon.upgrades, record[19:]))
+        # Weapons this version of the game does not have are dropped. The rest
+        # keep the order of a new player's weapons, which switching steps through
+        owned = {name: count for name, count in zip(names, ammo) if count != NOT_OWNED and name in weapon.weapons}
+        player.weapons = {name: owned[name] for name in list(player.weapons) + names if name in owned}
+        if player.current_weapon not in player.weapons:
+            player.current_weapon = next(iter(player.weapons))
+        players.append(player)
+    return players, game_map, round_num
+
+
+def save(path, game_map, players, round_num=1):
+    save_snapshot(path, snapshot(game_map, players, round_num))
+
+
+'''
+Load a binary save file through a memory map
+@return (players, game_map, round number)
+'''
+def load(path, screen, screen_dims, fps):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        # Nothing read may keep pointing into the map once it is closed
+        players, game_map, round_num = read(buffer, screen, screen_dims, fps)
+    return players, game_map, round_num
+
+
+'''
+Read a game saved in the old text format, which has no round number
+@param f is the open text file
+@return (players, game_map, 1)
+'''
+def read_text(f, screen, screen_dims, fps):
+    players = []
+
+    # First read the map
+    type = f.readline()[:-1]
+    game_map = Map(screen, type, screen_dims)
+    terrain = list(map(float, (f.readline()[1:-2]).split(', ')))
+    game_map.set_terrain(terrain)
+
+    # Read the number of players
+    num_players = int(f.readline()[:-1])
+    for i in range(num_players):
+        #Read the name, color and center
+        name = f.readline()[:-1]
+        color = tuple(json.loads(f.readline()[:-1]))
+        init_x, init_y = tuple(json.loads(f.readline()[:-1]))
+
+        #Create the player where it was saved
+        player = Player(screen, game_map, name, color, init_x, init_y, screen_dims, fps)
+        player.rect.center = (init_x, init_y)
+        game_map.tanks.move(player)
+        player.update_turret()
+
+        #Load the player stats
+        player.load(f)
+        _finish_death(player)
+        players.append(player)
+
+    return players, game_map, 1
+
+
+'''
+Load a save file of either format, going by its extension
+@return (players, game_map, round number)
+'''
+def load_any(path, screen, screen_dims, fps):
+    if path.endswith(EXTENSION):
+        return load(path, screen, screen_dims, fps)
+    with open(path) as f:
+        return read_text(f, screen, screen_dims, fps)
+
+
+'''
+Convert a text save file to the binary format, next to the original
+@return the path of the binary file
+'''
+def convert(path, screen_dims, fps):
+    players, game_map, round_num = load_any(path, None, screen_dims, fps)
+    target = os.path.splitext(path)[0] + EXTENSION
+    save(target, game_map, players, round_num)
+    return target
+
+
+def main(argv=None):
+    from Tanks import game
+    parser = argparse.ArgumentParser(description='Convert text save files to the binary save format.')
+    parser.add_argument('files', nargs='+', help='text save files (.txt) to convert')
+    parser.add_argument('--delete', action='store_true', help='remove each text file once it is converted')
+    args = parser.parse_args(argv)
+    for path in args.files:
+        try:
+            target = convert(path, game.SCREEN_DIMS, game.SIM_HZ)
+        except (OSError, ValueError) as e:
+            sys.stderr.write('{}: {}\n'.format(path, e))
+            continue
+        if args.delete:
+            os.remove(path)
+        print('{} -> {}'.format(path, target))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import os
+import json
+import numpy as np
+from Tanks import savefile
+
+'''
+An index of the saved games, so the load screen can list, page through and
+filter hundreds of saves without opening them.
+
+For every save file the index keeps its metadata: the map type and color,
+the round, the players' names, colors and scores, when it was saved and a
+thumbnail of the terrain (THUMBNAIL_WIDTH heights). The index is kept in
+INDEX_FILE inside the save directory. refresh() compares it against the
+directory and only reads the files that are new or changed since (by mtime
+and size), dropping the ones that are gone.
+'''
+
+INDEX_FILE = '.index.json'
+# Bump when the metadata kept per file changes, to rebuild old indexes
+INDEX_FORMAT = 1
+SAVE_EXTENSIONS = (savefile.EXTENSION, '.txt')
+THUMBNAIL_WIDTH = 64
+
+
+class SaveIndex:
+    '''
+    @param directory holds the save files
+    @param screen_dims and fps are the ones saves are loaded with
+    '''
+    def __init__(self, directory, screen_dims, fps):
+        self.directory = directory
+        self.screen_dims = screen_dims
+        self.fps = fps
+        self.entries = {}
+        self.read()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self):
+        try:
+            with open(self.path(INDEX_FILE)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get('format') == INDEX_FORMAT:
+            self.entries = index['entries']
+
+    def write(self):
+        temp = self.path(INDEX_FILE + '.tmp')
+        try:
+            with open(temp, 'w') as f:
+                json.dump({'format': INDEX_FORMAT, 'entries': self.entries}, f)
+            os.replace(temp, self.path(INDEX_FILE))
+        except OSError:
+            # A read only save directory just gets indexed again next time
+            pass
+
+    '''
+    Bring the index up to date with the save directory
+    @return True iff anything changed
+    '''
+    def refresh(self):
+        try:
+            files = [entry for entry in os.scandir(self.directory)
+                     if entry.is_file() and not entry.name.startswith('.') and entry.name.endswith(SAVE_EXTENSIONS)]
+        except OSError:
+            files = []
+        changed = False
+        entries = {}
+        for entry in files:
+            stat = entry.stat()
+            old = self.entries.get(entry.name)
+            if old is not None and old['mtime'] == stat.st_mtime and old['size'] == stat.st_size:
+                entries[entry.name] = old
+                continue
+            changed = True
+            try:
+                entries[entry.name] = self.describe(entry.name, stat)
+            except (OSError, ValueError, KeyError, IndexError):
+                # Not a save we can read, listed so it does not get read every time
+                entries[entry.name] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'broken': True}
+        changed = changed or len(entries) != len(self.entries)
+        self.entries = entries
+        if changed:
+            self.write()
+        return changed
+
+    '''
+    Read the metadata of a save file
+    '''
+    def describe(self, name, stat):
+        players, game_map, round_num = savefile.load_any(self.path(name), None, self.screen_dims, self.fps)
+        terrain = game_map.get_terrain()
+        columns = np.linspace(0, len(terrain) - 1, THUMBNAIL_WIDTH).astype(int)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size, 'broken': False,
+                'type': game_map.type, 'color': list(game_map.maps[game_map.type]['color']),
+                'round': round_num,
+                'players': [[player.name, list(player.color), player.total_score] for player in players],
+                'thumbnail': [int(height) for height in terrain[columns]]}
+
+    '''
+    The saves matching a filter, newest first
+    @param text is matched (ignoring case) against the file name, map type
+    and player names
+    @return a list of (file name, metadata)
+    '''
+    def find(self, text=''):
+        text = text.lower()
+        found = []
+        for name, entry in self.entries.items():
+            if entry['broken']:
+                continue
+            words = [name, entry['type']] + [player[0] for player in entry['players']]
+            if any(text in word.lower() for word in words):
+                found.append((name, entry))
+        found.sort(key=lambda item: item[1]['mtime'], reverse=True)
+        return found
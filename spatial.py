@@ -0,0 +1,125 @@
+import numpy as np
+
+'''
+A spatial index of the tanks on a map, so that a blast or a shell only has to
+look at the tanks near it instead of every tank in a large battle.
+
+Tanks sit on the terrain, so their x position is all that is indexed: the map
+is cut into columns of CELL_WIDTH pixels and each tank is filed under the
+column its center is in. Tanks off either edge of the map (on their way to
+wrap around) are filed under the first or last column.
+'''
+
+CELL_WIDTH = 64
+
+
+class TankGrid:
+    def __init__(self, width, cell_width=CELL_WIDTH):
+        self.cell_width = cell_width
+        self.cells = [{} for _ in range(max(int(width // cell_width) + 1, 1))]
+        # The cell each tank is filed under
+        self.where = {}
+
+    def cell(self, x):
+        return min(max(int(x // self.cell_width), 0), len(self.cells) - 1)
+
+    def add(self, player):
+        self.move(player)
+
+    def remove(self, player):
+        cell = self.where.pop(player, None)
+        if cell is not None:
+            del self.cells[cell][player]
+
+    '''
+    File a tank under the cell of its current position
+    '''
+    def move(self, player):
+        cell = self.cell(player.rect.centerx)
+        old = self.where.get(player)
+        if old == cell:
+            return
+        if old is not None:
+            del self.cells[old][player]
+        self.cells[cell][player] = None
+        self.where[player] = cell
+
+    '''
+    @return the tanks whose center is within reach of x horizontally (and
+    possibly a few more), in a deterministic order
+    '''
+    def near(self, x, reach):
+        found = []
+        for cell in range(self.cell(x - reach), self.cell(x + reach) + 1):
+            found.extend(self.cells[cell])
+        return found
+
+    '''
+    Find where a shell's path first runs into a standing tank: its body or the
+    hatch on top of it. Each step of the path, the segment between two of its
+    points, is only tested against the tanks filed under its cell and the
+    ones next to it, shells moving less than a cell in a step. A tank the
+    shell starts in (a bounce off a tank) is not hit.
+    @param xs and ys are the points of the path
+    @return (i, point) where the shell hits on its way from point i to point
+    i + 1, None if it hits no tank
+    '''
+    def first_hit(self, xs, ys):
+        if len(xs) < 2 or not self.where:
+            return None
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        x0, y0, dx, dy = xs[:-1], ys[:-1], np.diff(xs), np.diff(ys)
+        lowest = np.maximum(y0, ys[1:])
+        cells = np.clip(x0 // self.cell_width, 0, len(self.cells) - 1).astype(int)
+        hit = None
+        for cell in np.unique(cells).tolist():
+            tanks = [player for near in range(max(cell - 1, 0), min(cell + 2, len(self.cells)))
+                     for player in self.cells[near] if not (player.exploding or player.destroyed)]
+            if not tanks:
+                continue
+            lefts = np.array([p.rect.left for p in tanks])
+            rights = np.array([p.rect.right for p in tanks])
+            tops = np.array([p.rect.top - p.hatch_radius for p in tanks])
+            bottoms = np.array([p.rect.bottom for p in tanks])
+            # Steps that stay above every tank here cannot hit one
+            steps = np.flatnonzero((cells == cell) & (lowest >= tops.min()))
+            if hit is not None:
+                steps = steps[steps < hit[0]]
+            if not len(steps):
+                continue
+            enter_x, leave_x = _slab(x0[steps, None], dx[steps, None], lefts, rights)
+            enter_y, leave_y = _slab(y0[steps, None], dy[steps, None], tops, bottoms)
+            enter = np.maximum(np.maximum(enter_x, enter_y), 0)
+            hits = enter <= np.minimum(np.minimum(leave_x, leave_y), 1)
+            hits[:, (lefts <= xs[0]) & (xs[0] <= rights) & (tops <= ys[0]) & (ys[0] <= bottoms)] = False
+            rows = np.flatnonzero(hits.any(axis=1))
+            if len(rows):
+                row = rows[0]
+                t = enter[row][hits[row]].min()
+                step = int(steps[row])
+                hit = (step, (int(round(x0[step] + t*dx[step])), int(round(y0[step] + t*dy[step]))))
+        return hit
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, player):
+        return player in self.where
+
+
+'''
+Where a moving point is between lo and hi along one axis
+@param start and delta are the point's start and how far it moves (0 to 1 of the way)
+@return (enter, leave), the fractions of the way it enters and leaves, enter
+> leave if it never is between them
+'''
+def _slab(start, delta, lo, hi):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        to_lo = (lo - start)/delta
+        to_hi = (hi - start)/delta
+    inside = (lo <= start) & (start <= hi)
+    moving = delta != 0
+    enter = np.where(moving, np.minimum(to_lo, to_hi), np.where(inside, -np.inf, np.inf))
+    leave = np.where(moving, np.maximum(to_lo, to_hi), np.where(inside, np.inf, -np.inf))
+    return enter, leave
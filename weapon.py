@@ -1,5 +1,7 @@
-import pygame
 import math
+import numpy as np
+from collections import namedtuple
+from Tanks import ballistics
 
 '''
 This is a module with functions that define various types of weapons
@@ -10,6 +12,10 @@ velocity_scale_factor = 2.0
 gravity_scale_factor = 3.0
 time_resolution = 4.0
 g = 9.8*gravity_scale_factor
+# The turret turns in steps of this angle (player.TURRET_SPEED)
+angle_step = math.pi/20
+# Look regular shots up in the precomputed arcs of ballistics.py
+arc_tables = True
 
 
 '''
@@ -28,76 +34,257 @@ of various weapons given their initial position and initial velocity vector
 @param fps is the number of frames per second, helps determine the number of positions
 @param initial_velocity is the power with which the missile was fired
 @param angle the angle at which the missile is fired
+@param target is the (x, y) point aimed at, only used by weapons that are aimed instead of fired
+@return a list of Flight cursors, one per shell
 
 #################################################################
 '''
 def trajectory(start_pos, fps, initial_velocity, angle, terrain):
+    return trajectories([start_pos], fps, [initial_velocity], [angle], terrain)[0]
 
-    angle = math.pi - angle
-
-    v_x = velocity_scale_factor*initial_velocity * math.cos(angle)
-    v_y = -velocity_scale_factor*initial_velocity * math.sin(angle)
-    #Calculate the time step
-    time_unit = time_resolution/fps
-
-    #Adjust the angle
-    pos_x = int(start_pos[0])
-    pos_y = int(start_pos[1])
+'''
+A shell in flight: a cursor over the positions of its arc that hands out
+one (x, y) position per frame.
+@param on_land is called with (flight, terrain) once the last position has
+been handed out, and returns the shells that continue from there (e.g. the
+bounces of a volcano bomb), so those are only computed if the shell lands
+'''
+class Flight:
+    __slots__ = ('xs', 'ys', 'speed', 'index', 'on_land')
+
+    def __init__(self, xs, ys, speed, on_land=None):
+        self.xs = xs
+        self.ys = ys
+        self.speed = speed
+        self.index = 0
+        self.on_land = on_land
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.index >= len(self.xs):
+            raise StopIteration
+        self.index += 1
+        return self.xs[self.index - 1], self.ys[self.index - 1]
+
+    def __len__(self):
+        return len(self.xs) - self.index
+
+    def end(self):
+        return self.xs[-1], self.ys[-1]
+
+    def land(self, terrain):
+        return self.on_land(self, terrain) if self.on_land else []
+
+    '''
+    Cut the flight short where it hits something on its way from the
+    position at index to the next one
+    '''
+    def stop(self, index, point):
+        self.xs = self.xs[:index + 1] + [point[0]]
+        self.ys = self.ys[:index + 1] + [point[1]]
 
-    positions = [(pos_x, pos_y)]
+'''
+The batch ballistic engine: integrates any number of shells together, a chunk
+of time steps at a time, with numpy.
+Each shell follows the same steps as the original one-shell loop:
+
+    pos_x = pos_x + v_x*time_unit
+    pos_y = pos_y + v_y*time_unit + 0.5*g*time_unit**2
+    v_y = v_y + g*time_unit
+
+np.add.accumulate adds strictly left to right, so the running sums of those
+increments are reproducible to the bit, and the pixel a shell is at is its
+position truncated towards zero, like the original int(pos_x). Shells fired
+at a whole turret step and a whole power are not integrated here at all
+but follow their precomputed arc (see ballistics.py).
+A shell stops on the first step where it reaches the terrain height, or
+(without that step) once it leaves the terrain horizontally.
+
+@param start_positions, initial_velocities and angles hold one entry per shell
+@param resolution overrides the module time_resolution for these shells
+@return a list with a Flight per shell
+'''
+def trajectories(start_positions, fps, initial_velocities, angles, terrain, resolution=None):
+    terrain = np.asarray(terrain, dtype=float)
+    width = len(terrain)
+    time_unit = (time_resolution if resolution is None else resolution)/fps
+    drop = 0.5*g*time_unit**2
+    fall = g*time_unit
+
+    count = len(angles)
+    start_x = np.array([int(start[0]) for start in start_positions])
+    start_y = np.array([int(start[1]) for start in start_positions])
+    v_x = np.empty(count)
+    v_y = np.empty(count)
+    for i in range(count):
+        angle = math.pi - angles[i]
+        v_x[i] = velocity_scale_factor*initial_velocities[i] * math.cos(angle)
+        v_y[i] = -velocity_scale_factor*initial_velocities[i] * math.sin(angle)
+    step_x = v_x*time_unit
+
+    paths_x = [[start_x[i:i+1]] for i in range(count)]
+    paths_y = [[start_y[i:i+1]] for i in range(count)]
+    final_v_y = v_y.copy()
+    integrate = ~_landed(start_x, start_y, terrain, width)
+    arcs = ballistics.table(velocity_scale_factor, g, time_unit, angle_step) if arc_tables and resolution is None else None
+    if arcs is not None:
+        indices = arcs.index(angles, initial_velocities)
+        shells = np.flatnonzero(integrate & (indices >= 0))
+        if len(shells):
+            stopped, columns, rows, starts, steps, arc_v_y = arcs.fly(indices[shells], start_x[shells], start_y[shells], terrain)
+            for shell, start, length in zip(shells[stopped].tolist(), starts[stopped].tolist(), steps[stopped].tolist()):
+                paths_x[shell] = [columns[start:start + length]]
+                paths_y[shell] = [rows[start:start + length]]
+            shells = shells[stopped]
+            v_x[shells] = arcs.v_x[indices[shells]]
+            final_v_y[shells] = arc_v_y[stopped]
+            integrate[shells] = False
+
+    # Where every shell is so far
+    x = start_x.astype(float)
+    y = start_y.astype(float)
+    flying = np.flatnonzero(integrate)
+    chunk = 64
+    while len(flying):
+        # Running sums over [covered, increment, increment, ...] for every flying shell
+        xs = np.empty((len(flying), chunk + 1))
+        xs[:, 0] = x[flying]
+        xs[:, 1:] = step_x[flying, None]
+        xs = np.add.accumulate(xs, axis=1)[:, 1:]
+        v_ys = np.empty((len(flying), chunk + 1))
+        v_ys[:, 0] = v_y[flying]
+        v_ys[:, 1:] = fall
+        v_ys = np.add.accumulate(v_ys, axis=1)
+        ys = np.empty((len(flying), 2*chunk + 1))
+        ys[:, 0] = y[flying]
+        ys[:, 1::2] = v_ys[:, :-1]*time_unit
+        ys[:, 2::2] = drop
+        ys = np.add.accumulate(ys, axis=1)[:, 2::2]
+
+        columns = np.trunc(xs).astype(int)
+        rows = np.trunc(ys).astype(int)
+        outside = (columns >= width) | (columns < -width)
+        landed = ~outside & _landed(columns, rows, terrain, width)
+        stopped = outside | landed
+        still_flying = []
+        for row, shell in enumerate(flying):
+            stops = np.flatnonzero(stopped[row])
+            if not len(stops):
+                paths_x[shell].append(columns[row])
+                paths_y[shell].append(rows[row])
+                x[shell] = xs[row, -1]
+                y[shell] = ys[row, -1]
+                v_y[shell] = v_ys[row, -1]
+                still_flying.append(shell)
+                continue
+            # Leaving the terrain drops the step, landing keeps it
+            steps = stops[0] + (1 if landed[row, stops[0]] else 0)
+            paths_x[shell].append(columns[row, :steps])
+            paths_y[shell].append(rows[row, :steps])
+            final_v_y[shell] = v_ys[row, steps]
+        flying = np.array(still_flying, dtype=int)
+        chunk = min(2*chunk, 1024)
+
+    flights = []
+    for shell in range(count):
+        path_x = np.concatenate(paths_x[shell]).tolist()
+        path_y = np.concatenate(paths_y[shell]).tolist()
+        speed = math.sqrt(float(v_x[shell])**2 + float(final_v_y[shell])**2)
+        flights.append(Flight(path_x, path_y, speed))
+    return flights
 
-    while int(pos_y) < terrain[int(pos_x)]:
-        pos_x = pos_x + v_x * time_unit
-        if int(pos_x)>=len(terrain):
-            break
-        pos_y = pos_y + v_y*time_unit + 0.5*g*time_unit**2
-        v_y = v_y + g * time_unit
-        positions.append((int(pos_x), int(pos_y)))
+'''
+Where each shell lands, the same as trajectories(...)[i].end() but without
+building the flights. Shells that can be looked up in the arc tables cost
+no integration and no per shell bookkeeping, which makes this the one to
+use to try out many shots (see ai.ShotSolver)
+@return a list with the (x, y) landing pixel of each shell
+'''
+def impacts(start_positions, fps, initial_velocities, angles, terrain):
+    terrain = np.asarray(terrain, dtype=float)
+    start_x = np.array([int(start[0]) for start in start_positions], dtype=int)
+    start_y = np.array([int(start[1]) for start in start_positions], dtype=int)
+    ends = [(x, y) for x, y in zip(start_x.tolist(), start_y.tolist())]
+    flying = ~_landed(start_x, start_y, terrain, len(terrain))
+    arcs = ballistics.table(velocity_scale_factor, g, time_resolution/fps, angle_step) if arc_tables else None
+    if arcs is not None:
+        indices = arcs.index(angles, initial_velocities)
+        shells = np.flatnonzero(flying & (indices >= 0))
+        if len(shells):
+            stopped, columns, rows, starts, steps, _ = arcs.fly(indices[shells], start_x[shells], start_y[shells], terrain)
+            shells = shells[stopped]
+            last = (starts + steps - 1)[stopped]
+            for shell, x, y in zip(shells.tolist(), columns[last].tolist(), rows[last].tolist()):
+                ends[shell] = (x, y)
+            flying[shells] = False
+    rest = np.flatnonzero(flying).tolist()
+    if rest:
+        flights = trajectories([start_positions[i] for i in rest], fps, [initial_velocities[i] for i in rest],
+                               [angles[i] for i in rest], terrain)
+        for shell, flight in zip(rest, flights):
+            ends[shell] = flight.end()
+    return ends
 
-    return positions, math.sqrt((v_x**2 + v_y**2))
+'''
+Whether the shells at pixels (columns, rows) are at or below the terrain
+(negative columns index from the right end, as they always have)
+'''
+def _landed(columns, rows, terrain, width):
+    inside = (columns < width) & (columns >= -width)
+    heights = terrain[np.where(inside, columns, 0)]
+    return ~inside | (rows >= heights)
 
-def missile_path(start_pos, fps, initial_velocity, angle, terrain):
-    return [trajectory(start_pos, fps, initial_velocity, angle, terrain)[0]]
+def missile_path(start_pos, fps, initial_velocity, angle, terrain, target=None):
+    return [trajectory(start_pos, fps, initial_velocity, angle, terrain)]
 
-def volcano_path(start_pos, fps, initial_velocity, angle, terrain):
+def volcano_path(start_pos, fps, initial_velocity, angle, terrain, target=None):
     initial_trajectory = trajectory(start_pos, fps, initial_velocity, angle, terrain)
-    init_path = initial_trajectory[0]
-    final_v = initial_trajectory[1]
-    end_pos = init_path[-1]
+    initial_trajectory.on_land = lambda flight, terrain: volcano_bounces(flight, fps, terrain)
+    return [initial_trajectory]
+
+'''
+The three shells a volcano bomb throws up where it lands
+'''
+def volcano_bounces(flight, fps, terrain):
+    final_v = flight.speed
+    end_pos = flight.end()
     if end_pos[0]< len(terrain)-1 and end_pos[0]> 0:
         ground_angle = math.atan2(terrain[end_pos[0]+1] - terrain[end_pos[0]-1], 1)
     else:
         ground_angle = 0
-    bounce_trajectories = []
-    for i in range(3):
-        bounce = trajectory((end_pos[0], terrain[end_pos[0]]-1), fps, final_v/5, ground_angle + i*(math.pi/4), terrain)[0]
-        bounce_trajectories.append(init_path + bounce)
-    return [init_path] + bounce_trajectories
+    bounce_start = (end_pos[0], terrain[end_pos[0]]-1)
+    return trajectories([bounce_start]*3, fps, [final_v/5]*3, [ground_angle + i*(math.pi/4) for i in range(3)], terrain)
 
 
-def shower_path(start_pos, fps, initial_velocity, angle, terrain):
-    trajectories = []
-    for factor in [0.8, 0.9, 1, 1.1, 1.2]:
-        trajectories.append(trajectory(start_pos, fps, factor*initial_velocity, angle, terrain)[0])
-    return trajectories
+def shower_path(start_pos, fps, initial_velocity, angle, terrain, target=None):
+    factors = [0.8, 0.9, 1, 1.1, 1.2]
+    return trajectories([start_pos]*len(factors), fps, [factor*initial_velocity for factor in factors], [angle]*len(factors), terrain)
 
-def airstrike_path(start_pos, fps, initial_velocity, angle, terrain):
-    global time_resolution
-    selected = False
-    while not selected:
-        for event in pygame.event.get():
-            if event.type==pygame.QUIT:
-                return
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                x,y = pygame.mouse.get_pos()
-                selected = True
-                break
-    save_time = time_resolution
-    time_resolution = 6
-    trajectories = [trajectory((x, 0), fps, -50, math.pi/2, terrain)[0]]
-    time_resolution = save_time
-    return trajectories
+'''
+An air strike drops straight down from the top of the screen onto the column
+of its target. The game loop has the player pick the target (see
+game.game_sequence), so this only computes the fall
+'''
+def airstrike_path(start_pos, fps, initial_velocity, angle, terrain, target=None):
+    if target is None:
+        raise ValueError('a Precision Air Strike needs a target')
+    # Air strikes drop faster, with a coarser time step than regular shells
+    return trajectories([(target[0], 0)], fps, [-50], [math.pi/2], terrain, resolution=6)
 
+'''
+@param tanks is the spatial.TankGrid of the map, a strike goes off on the
+first tank in its way like it does when fired (see Engine.collide)
+@return the (x, y) point an air strike sent to target lands on
+'''
+def airstrike_landing(target, fps, terrain, tanks=None):
+    flight = airstrike_path(None, fps, None, None, terrain, target)[0]
+    hit = tanks.first_hit(flight.xs, flight.ys) if tanks is not None else None
+    if hit is not None:
+        flight.stop(*hit)
+    x, y = flight.end()
+    return int(x), int(y)
 
 
 
@@ -133,10 +320,30 @@ upgrades = {"Upgrade Armor": [250, 1],
             "Health Recharge": [350,1]}
 
 
+'''
+The animation of a blast: frames holds a (color, radius) pair per frame in
+the order they are shown, max_radius is the largest radius of them all
+'''
+Blast = namedtuple('Blast', ['frames', 'max_radius'])
+
+# Blasts already worked out, by (weapon or 'Death', fps)
+blasts = {}
+
+'''
+@return the Blast of a weapon (or of a tank dying with type 'Death'). Blasts
+only depend on the weapon and fps, so each one is worked out once and then
+shared by every impact, never to be modified
+'''
 def explode(type, fps):
+    key = (type, fps)
+    if key not in blasts:
+        blasts[key] = _blast(type, fps)
+    return blasts[key]
+
+def _blast(type, fps):
 
     time_step = 1
-    if type is 'Death':
+    if type == 'Death':
         max_radius = 40
         end_radius_factor = 0.1
     else:
@@ -154,6 +361,5 @@ def explode(type, fps):
         time+=time_step
         radii.append(int(radius))
 
-
-    return list(map(lambda x: ((255, int(peak_color-x[0]*(peak_color/len(radii))),0),x[1])  , enumerate(radii)))
-
+    frames = tuple(((255, int(peak_color-i*(peak_color/len(radii))),0), radius) for i, radius in enumerate(radii))
+    return Blast(frames, max(radii))